@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# coding=utf8
+# 动作序列衔接：把多个动作组拼接成一个连续的帧序列，
+# 在安全的情况下去掉动作之间多余的立正姿态
+import numpy as np
+
+# 腿部舵机的下标(舵机1~5为右腿，9~13为左腿，6~8和14~16为手臂)
+leg_servos = [0, 1, 2, 3, 4, 8, 9, 10, 11, 12]
+
+STAND_TOLERANCE = 30      # 与立正姿态相差不超过该值时视为立正姿态
+SAFE_LEG_DELTA = 120      # 直接过渡时腿部舵机允许的最大位置变化
+TRANSITION_SPEED = 1000   # 过渡时舵机的最大速度(舵机位置单位/秒)
+MIN_TRANSITION_TIME = 100 # 过渡帧的最短运行时间(毫秒)
+
+def is_stand_pose(frame, stand_pose, tolerance=STAND_TOLERANCE):
+    return np.max(np.abs(frame.astype(np.int32) - stand_pose)) <= tolerance
+
+def is_safe_transition(a, b, max_leg_delta=SAFE_LEG_DELTA):
+    """不经过立正姿态直接从姿态a过渡到姿态b是否安全"""
+    delta = np.abs(a.astype(np.int32) - b.astype(np.int32))
+    return np.max(delta[leg_servos]) <= max_leg_delta
+
+def transition_time(a, b, speed=TRANSITION_SPEED, min_time=MIN_TRANSITION_TIME):
+    """
+    从姿态a过渡到姿态b所需的时间(毫秒)
+
+    总线舵机在一条运动指令内会匀速运动到目标位置，
+    因此过渡只需要一帧，按变化最大的舵机计算运行时间
+    """
+    delta = np.max(np.abs(a.astype(np.int32) - b.astype(np.int32)))
+    return max(int(round(delta * 1000.0 / speed)), min_time)
+
+def trim_range(frames, stand_pose, from_start):
+    """去掉开头(或结尾)连续的立正姿态，至少保留一帧，返回保留的帧数"""
+    n = len(frames)
+    order = range(n) if from_start else range(n - 1, -1, -1)
+    count = 0
+    for i in order:
+        if count == n - 1 or not is_stand_pose(frames[i], stand_pose):
+            break
+        count += 1
+    return count
+
+def blend_sequence(groups, stand_pose=None):
+    """
+    将多个动作组拼接成一个连续的帧序列
+
+    相邻两个动作之间，若前一个动作以立正姿态结束、后一个动作以立正姿态开始，
+    且去掉这些立正姿态后的直接过渡是安全的，则跳过这些立正姿态。
+    后一个动作的第一帧按两帧之间的舵机位置变化重新计算运行时间
+
+    Args:
+        groups: 动作组列表，每个元素为(frames, times)
+        stand_pose: 立正姿态，为None时不跳过任何帧
+
+    Returns:
+        (frames, times)，可直接播放的帧序列
+    """
+    segments = []
+    for frames, times in groups:
+        if len(times) == 0:
+            continue
+        segments.append([np.asarray(frames), np.asarray(times, dtype=np.uint32).copy(), 0, len(times), False])
+
+    if stand_pose is not None:
+        stand_pose = np.asarray(stand_pose, dtype=np.int32)
+        for prev, cur in zip(segments[:-1], segments[1:]):
+            tail = trim_range(prev[0][prev[2]:prev[3]], stand_pose, False)
+            head = trim_range(cur[0][cur[2]:cur[3]], stand_pose, True)
+            if tail == 0 or head == 0:
+                # 两边都是立正姿态时才跳过
+                continue
+            a = prev[0][prev[3] - tail - 1]
+            b = cur[0][cur[2] + head]
+            if is_safe_transition(a, b):
+                prev[3] -= tail
+                cur[2] += head
+                cur[4] = True
+
+    out_frames = []
+    out_times = []
+    last = None
+    for frames, times, start, end, retime in segments:
+        frames = frames[start:end]
+        times = times[start:end]
+        if retime:
+            times[0] = transition_time(last, frames[0])
+        out_frames.append(frames)
+        out_times.append(times)
+        last = frames[-1]
+
+    if not out_frames:
+        return np.zeros((0, 16), dtype=np.uint16), np.zeros(0, dtype=np.uint32)
+    return (np.ascontiguousarray(np.concatenate(out_frames), dtype=np.uint16),
+            np.concatenate(out_times).astype(np.uint32))
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# coding=utf8
+# 动作组打包文件：将多个动作组打包成一个二进制文件，通过mmap零拷贝读取
+#
+# 文件格式(小端)：
+#   文件头    magic(4s) version(H) servo_num(H) count(I)
+#   索引      count个条目，每个条目为 name(32s) offset(I) frame_count(I) total_time(I)
+#   帧记录    每帧为 time(I) + servo_num个舵机位置(H)，按动作组连续存放
+import os
+import mmap
+import struct
+import numpy as np
+
+MAGIC = b'TPAB'
+VERSION = 1
+NAME_SIZE = 32
+
+header_struct = struct.Struct('<4sHHI')
+index_struct = struct.Struct('<%dsIII' % NAME_SIZE)
+
+def frame_dtype(servo_num):
+    return np.dtype([('time', '<u4'), ('servo', '<u2', (servo_num,))])
+
+def write_bundle(out_path, groups):
+    """
+    写入动作组打包文件，先写临时文件再替换，正在读取旧文件的进程不受影响
+
+    Args:
+        out_path: 打包文件路径
+        groups: 字典，动作组名称 -> (frames, times)
+    """
+    names = sorted(groups)
+    servo_num = groups[names[0]][0].shape[1] if names else 0
+    dtype = frame_dtype(servo_num)
+
+    offset = header_struct.size + index_struct.size * len(names)
+    index = []
+    records = []
+    for name in names:
+        frames, times = groups[name]
+        key = name.encode('utf8')
+        if len(key) > NAME_SIZE:
+            raise ValueError('动作组名称过长: %s' % name)
+        rec = np.zeros(len(times), dtype=dtype)
+        rec['time'] = times
+        rec['servo'] = frames
+        index.append(index_struct.pack(key, offset, len(times), int(np.sum(times))))
+        records.append(rec.tobytes())
+        offset += rec.nbytes
+
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header_struct.pack(MAGIC, VERSION, servo_num, len(names)))
+        for entry in index:
+            f.write(entry)
+        for rec in records:
+            f.write(rec)
+    os.replace(tmp_path, out_path)
+
+class ActionBundle:
+    """
+    以mmap方式打开的动作组打包文件，get()返回的数组直接引用映射内存，不发生拷贝
+
+    Args:
+        path: 打包文件路径
+    """
+    def __init__(self, path):
+        self.path = path
+        st = os.stat(path)
+        self.mtime = st.st_mtime
+        self.size = st.st_size
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.servo_num, count = header_struct.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError('不是有效的动作组打包文件: %s' % path)
+        self.dtype = frame_dtype(self.servo_num)
+
+        # 索引：名称 -> (偏移, 帧数, 总时长)
+        self.index = {}
+        for i in range(count):
+            name, offset, frame_count, total_time = index_struct.unpack_from(
+                self.mm, header_struct.size + i * index_struct.size)
+            self.index[name.rstrip(b'\0').decode('utf8')] = (offset, frame_count, total_time)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return sorted(self.index)
+
+    def get(self, name):
+        """
+        Returns:
+            (frames, times)，均为映射内存上的只读视图，动作组不存在时返回None
+        """
+        entry = self.index.get(name)
+        if entry is None:
+            return None
+        offset, frame_count, total_time = entry
+        rec = np.frombuffer(self.mm, dtype=self.dtype, count=frame_count, offset=offset)
+        return rec['servo'], rec['time']
+
+    def close(self):
+        # 仍有数组引用映射内存时无法关闭，交给垃圾回收处理
+        try:
+            self.mm.close()
+        except BufferError:
+            pass
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# coding=utf8
+# 动作组编译：把每一帧预先编译成可直接写入总线的数据，
+# 播放时每帧只需一次write，不再逐个舵机组装指令
+import numpy as np
+from ActionDelta import delta_mask, DEADBAND, PACKET_SIZE
+
+FRAME_HEADER = 0x55
+SERVO_MOVE_TIME_WRITE = 1
+
+def compile_packets(frames, times):
+    """
+    生成每一帧每个舵机的运动指令
+
+    指令格式：0x55 0x55 ID 长度(7) 指令(1) 位置低字节 位置高字节 时间低字节 时间高字节 校验和
+
+    Args:
+        frames: 舵机位置，形状为(帧数, 舵机数)
+        times: 每帧的运行时间(毫秒)
+
+    Returns:
+        uint8数组，形状为(帧数, 舵机数, 10)
+    """
+    frames = np.asarray(frames, dtype=np.uint16)
+    times = np.asarray(times, dtype=np.uint16)
+    n, servo_num = frames.shape
+    packets = np.empty((n, servo_num, PACKET_SIZE), dtype=np.uint8)
+    packets[:, :, 0] = FRAME_HEADER
+    packets[:, :, 1] = FRAME_HEADER
+    packets[:, :, 2] = np.arange(1, servo_num + 1, dtype=np.uint8)
+    packets[:, :, 3] = 7
+    packets[:, :, 4] = SERVO_MOVE_TIME_WRITE
+    packets[:, :, 5] = frames & 0xff
+    packets[:, :, 6] = frames >> 8
+    packets[:, :, 7] = (times & 0xff)[:, None]
+    packets[:, :, 8] = (times >> 8)[:, None]
+    checksum = packets[:, :, 2:9].sum(axis=2, dtype=np.uint32)
+    packets[:, :, 9] = ~checksum & 0xff
+    return packets
+
+class CompiledAction:
+    """
+    编译好的动作组
+
+    buffers[0]为第一帧全部舵机的指令，之后每帧只包含位置变化超过死区的舵机，
+    变化是相对于第一帧全部发送后的状态计算的
+
+    Args:
+        frames: 舵机位置，形状为(帧数, 舵机数)
+        times: 每帧的运行时间(毫秒)
+        deadband: 死区，为-1时每帧发送全部舵机
+    """
+    def __init__(self, frames, times, deadband=DEADBAND):
+        self.frames = frames
+        self.times_ms = np.asarray(times, dtype=np.uint32)
+        self.times = [t / 1000.0 for t in self.times_ms.tolist()]
+        self.deadband = deadband
+        self.packets = compile_packets(frames, times)
+        self.masks = delta_mask(frames, deadband)
+        self.buffers = [self.packets[i][self.masks[i]].tobytes() for i in range(len(self.packets))]
+
+        # poses[i]为发送完第i帧后各舵机最近一次发送的位置
+        n, servo_num = self.masks.shape
+        last = np.maximum.accumulate(np.where(self.masks, np.arange(n)[:, None], 0), axis=0)
+        self.poses = np.asarray(frames, dtype=np.int32)[last, np.arange(servo_num)]
+
+    def __len__(self):
+        return len(self.buffers)
+
+    def transition_buffer(self, pose, i):
+        """
+        从舵机位置pose直接到达第i帧的指令，用于第一帧或跳帧之后，
+        发送后各舵机的位置与按顺序播放到第i帧时完全相同
+
+        Args:
+            pose: 当前各舵机最近一次发送的位置，为None时发送全部舵机
+            i: 帧序号
+        """
+        target = self.poses[i]
+        if pose is None:
+            changed = np.ones(len(target), dtype=bool)
+        else:
+            changed = target != pose
+        if i == 0 or not np.any(changed & ~self.masks[i]):
+            return self.packets[i][changed].tobytes()
+        packets = compile_packets(target[None], self.times_ms[i:i + 1])[0]
+        return packets[changed].tobytes()
+
+def get_compiled(data, deadband=DEADBAND):
+    """获取动作组的编译结果，与动作组数据一起缓存，动作组重新加载后自动重新编译"""
+    compiled = data.compiled
+    if compiled is None or compiled.deadband != deadband:
+        compiled = CompiledAction(data.frames, data.times, deadband)
+        data.compiled = compiled
+    return compiled
+
+def build_packet(id, w_cmd, dat1, dat2):
+    """逐个舵机组装指令，与hiwonder.BusServoCmd的做法相同，用于对比测试"""
+    buf = bytearray(b'\x55\x55')
+    buf.append(id)
+    buf.append(7)
+    buf.append(w_cmd)
+    buf.extend([(0xff & dat1), (0xff & (dat1 >> 8))])
+    buf.extend([(0xff & dat2), (0xff & (dat2 >> 8))])
+    s = 0
+    for b in buf[2:]:
+        s += b
+    buf.append(~s & 0xff)
+    return buf
+
+def benchmark(frames, times, repeat=200):
+    """比较逐个舵机组装指令和预编译两种方式每帧的Python耗时"""
+    import time
+
+    class NullSerial:
+        def write(self, buf):
+            return len(buf)
+
+    bus = NullSerial()
+    frame_list = np.asarray(frames).tolist()
+    time_list = np.asarray(times).tolist()
+    n = len(frame_list) * repeat
+
+    t = time.perf_counter()
+    for r in range(repeat):
+        for frame, use_time in zip(frame_list, time_list):
+            for i, pulse in enumerate(frame):
+                bus.write(build_packet(i + 1, SERVO_MOVE_TIME_WRITE, pulse, use_time))
+    before = (time.perf_counter() - t) / n
+
+    compiled = CompiledAction(frames, times, -1)
+    t = time.perf_counter()
+    for r in range(repeat):
+        for buf in compiled.buffers:
+            bus.write(buf)
+    after = (time.perf_counter() - t) / n
+    return before, after
+
+if __name__ == '__main__':
+    import sys
+    from ActionGroupCache import ActionGroupCache, action_path
+
+    # python3 ActionCompiler.py [动作组文件夹]
+    cache = ActionGroupCache(sys.argv[1] if len(sys.argv) > 1 else action_path)
+    for name in cache.names():
+        data = cache.get(name)
+        before, after = benchmark(data.frames, data.times)
+        print('%-24s 逐个组装: %7.1fus/帧   预编译: %5.2fus/帧' % (name, before * 1e6, after * 1e6))
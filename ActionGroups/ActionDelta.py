@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# coding=utf8
+# 帧差分：只向位置变化超过死区的舵机发送指令，减少总线数据量
+import numpy as np
+
+# 一条总线舵机运动指令的字节数：帧头(2) + ID + 长度 + 指令 + 位置(2) + 时间(2) + 校验和
+PACKET_SIZE = 10
+
+DEADBAND = 2  # 舵机位置变化不超过该值时不发送指令
+
+def delta_mask(frames, deadband=DEADBAND, start_pose=None):
+    """
+    计算每一帧需要发送指令的舵机
+
+    与上一次实际发送的位置比较，而不是与上一帧比较，
+    因此被跳过的舵机与目标位置的误差不会超过死区
+
+    Args:
+        frames: 舵机位置，形状为(帧数, 舵机数)
+        deadband: 死区
+        start_pose: 播放前舵机的位置，为None时第一帧发送全部舵机
+
+    Returns:
+        bool数组，形状与frames相同
+    """
+    frames = np.asarray(frames, dtype=np.int32)
+    mask = np.ones(frames.shape, dtype=bool)
+    if len(frames) == 0:
+        return mask
+    if start_pose is None:
+        sent = frames[0].copy()
+        first = 1
+    else:
+        sent = np.asarray(start_pose, dtype=np.int32).copy()
+        first = 0
+    for i in range(first, len(frames)):
+        changed = np.abs(frames[i] - sent) > deadband
+        mask[i] = changed
+        sent[changed] = frames[i][changed]
+    return mask
+
+def delta_stats(frames, deadband=DEADBAND, start_pose=None, lock_mask=None):
+    """
+    统计一个动作组使用帧差分前后的总线数据量
+
+    Args:
+        frames: 舵机位置，形状为(帧数, 舵机数)
+        deadband: 死区
+        start_pose: 播放前舵机的位置，为None时第一帧发送全部舵机
+        lock_mask: 被锁定(不发送)的舵机，bool数组，形状为(舵机数,)
+
+    Returns:
+        (全部发送的字节数, 差分后的字节数)
+    """
+    frames = np.asarray(frames)
+    mask = delta_mask(frames, deadband, start_pose)
+    full = np.ones(frames.shape, dtype=bool)
+    if lock_mask is not None:
+        mask &= ~lock_mask
+        full &= ~lock_mask
+    return int(full.sum()) * PACKET_SIZE, int(mask.sum()) * PACKET_SIZE
+
+if __name__ == '__main__':
+    import sys
+    from ActionGroupCache import ActionGroupCache, action_path
+
+    # python3 ActionDelta.py [动作组文件夹] [死区]
+    # 有stand动作组时，按从立正姿态开始播放统计
+    cache = ActionGroupCache(sys.argv[1] if len(sys.argv) > 1 else action_path)
+    deadband = int(sys.argv[2]) if len(sys.argv) > 2 else DEADBAND
+    stand = cache.get('stand')
+    start_pose = stand.frames[-1] if stand is not None else None
+    total_full = total_delta = 0
+    for name in cache.names():
+        data = cache.get(name)
+        full, delta = delta_stats(data.frames, deadband, start_pose)
+        total_full += full
+        total_delta += delta
+        saved = 100.0 * (full - delta) / full if full else 0
+        print('%-24s %6dB -> %6dB  节省%5.1f%%' % (name, full, delta, saved))
+    if total_full:
+        print('合计: %dB -> %dB  节省%.1f%%' % (total_full, total_delta,
+              100.0 * (total_full - total_delta) / total_full))
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+# coding=utf8
+# 动作执行线程：所有动作组由一个线程按优先级依次执行，提交动作不阻塞调用者，
+# 正在执行的动作组可以在帧之间被打断，连续的同一步态指令合并为一次连续行走
+import queue
+import itertools
+import threading
+from concurrent.futures import Future
+import ActionPlayer
+from ActionRegistry import go_actions, back_actions, is_gait, is_opposite
+from ActionGait import has_segments
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+class ActionRequest:
+    __slots__ = ('name', 'times', 'with_stand', 'lock_servos', 'speed', 'future', 'preempted',
+                 'extra', 'open', 'cut')
+
+    def __init__(self, name, times=1, with_stand=False, lock_servos='', speed=1.0):
+        self.name = name
+        self.times = times
+        self.with_stand = with_stand
+        self.lock_servos = lock_servos
+        self.speed = speed
+        self.future = Future()
+        self.preempted = False
+        self.extra = 0      # 步态类动作组还要循环的次数
+        self.open = False   # 步态类动作组正在执行，可以合并相同的指令
+        self.cut = False    # 收到相反方向的指令，提前结束
+
+    def coalesce(self, name, times, lock_servos, speed):
+        """相同的步态指令合并到正在执行的请求，返回是否已合并"""
+        if not self.open or name != self.name or lock_servos != self.lock_servos or speed != self.speed:
+            return False
+        self.extra = max(self.extra, times)
+        return True
+
+class ActionExecutor:
+    """
+    动作执行线程
+
+    submit()返回Future，动作组完整执行后结果为True，被打断时结果为False；
+    动作组没有执行(文件不存在或其他线程正在执行动作)时Future中为RuntimeError，执行出错时为该异常
+
+    步态类动作组(ActionRegistry.gait_directions)执行期间再次提交相同的动作组时，
+    不再排队从头执行，而是让正在执行的步态至少再循环times次，返回正在执行的Future；
+    提交相反方向的步态时，正在执行的步态提前结束
+
+    Args:
+        maxsize: 等待队列的最大长度
+        stand_action: 打断后恢复站立使用的动作组
+    """
+    def __init__(self, maxsize=8, stand_action='stand'):
+        self.queue = queue.PriorityQueue(maxsize)
+        self.stand_action = stand_action
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.current = None
+        self.active = 0  # 正在执行和等待中的动作组数量
+        self.thread = threading.Thread(target=self.worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, name, times=1, with_stand=False, lock_servos='', speed=1.0,
+               priority=PRIORITY_NORMAL, preempt=False, stand=False):
+        """
+        提交动作组，立即返回
+
+        Args:
+            name: 动作组名称
+            times, with_stand, lock_servos, speed: 与ActionPlayer.runActionGroup相同
+            priority: 优先级，数值越小越先执行
+            preempt: 是否打断正在执行的动作组并清空等待队列
+            stand: 打断后是否先恢复站立再执行该动作组
+
+        Returns:
+            Future，队列已满时Future中为queue.Full异常
+        """
+        with self.lock:
+            current = self.current
+            if current is not None and is_gait(name):
+                if current.coalesce(name, times, lock_servos, speed):
+                    return current.future
+                if current.open and is_opposite(current.name, name):
+                    # 相反方向的指令：提前结束当前步态，不打断正在执行的一步
+                    current.cut = True
+                    current.open = False
+                    preempt = False
+                    self.clear_locked()
+
+        request = ActionRequest(name, times, with_stand, lock_servos, speed)
+        if preempt:
+            self.clear()
+            self.preempt(stand)
+        try:
+            self.put(priority, request)
+        except queue.Full as e:
+            print('动作队列已满，忽略动作: %s' % name)
+            request.future.set_exception(e)
+        return request.future
+
+    def put(self, priority, request):
+        with self.lock:
+            self.queue.put_nowait((priority, next(self.counter), request))
+            self.active += 1
+
+    def preempt(self, stand=False):
+        """
+        在下一帧打断正在执行的动作组
+
+        Args:
+            stand: 有动作组被打断时，是否先恢复站立
+        """
+        with self.lock:
+            request = self.current
+            if request is not None:
+                request.preempted = True
+                ActionPlayer.stopAction()
+                ActionPlayer.stopActionGroup()
+        if stand and request is not None:
+            try:
+                self.put(PRIORITY_HIGH - 1, ActionRequest(self.stand_action))
+            except queue.Full:
+                pass
+
+    def clear(self):
+        """取消所有等待中的动作组"""
+        with self.lock:
+            self.clear_locked()
+
+    def clear_locked(self):
+        while True:
+            try:
+                priority, seq, request = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            request.future.cancel()
+            self.active -= 1
+
+    def cancel(self, future):
+        """取消一个动作组，等待中的直接取消，正在执行的在下一帧打断"""
+        if future.cancel():
+            return True
+        with self.lock:
+            request = self.current
+            if request is not None and request.future is future:
+                request.preempted = True
+                ActionPlayer.stopAction()
+                ActionPlayer.stopActionGroup()
+                return True
+        return False
+
+    def busy(self):
+        """是否有正在执行或等待中的动作组"""
+        return self.active > 0
+
+    def coalesces(self, name):
+        """提交name时是否会与正在执行的步态合并或使其提前结束，可用于判断忙碌时是否需要提交"""
+        with self.lock:
+            current = self.current
+            return (current is not None and current.open and is_gait(name) and
+                    (current.name == name or is_opposite(current.name, name)))
+
+    def more(self, request):
+        """步态类动作组是否继续循环"""
+        with self.lock:
+            if request.cut or request.preempted:
+                more = False
+            elif request.times == 0:
+                more = not ActionPlayer.stop_action_group
+            elif request.extra > 0:
+                request.extra -= 1
+                more = True
+            else:
+                more = False
+            if not more:
+                request.open = False
+            return more
+
+    def run_gait(self, request):
+        """执行步态类动作组，返回是否执行了动作组"""
+        name = request.name
+        segmented = has_segments(ActionPlayer.action_cache, name)
+        if (name in go_actions or name in back_actions) and not segmented:
+            # 起步、行走和收步分别为不同的动作组，由runActionGroup依次执行
+            if not ActionPlayer.runActionGroup(name, 1, False, request.lock_servos, request.speed):
+                return False
+            while self.more(request):
+                ActionPlayer.runActionGroup(name, 1, False, request.lock_servos, request.speed)
+            if request.with_stand or request.cut or request.preempted or ActionPlayer.stop_action_group:
+                # stop_action_group置位时runActionGroup只执行收步动作
+                ActionPlayer.stopActionGroup()
+                ActionPlayer.runActionGroup(name, 1, False, request.lock_servos, request.speed)
+            return True
+        return ActionPlayer.runActionLoop(name, lambda: self.more(request), lambda: request.cut,
+                                          request.lock_servos, request.speed) != 0
+
+    def worker(self):
+        while True:
+            priority, seq, request = self.queue.get()
+            if not request.future.set_running_or_notify_cancel():
+                with self.lock:
+                    self.active -= 1
+                continue
+            with self.lock:
+                ActionPlayer.stop_action = False
+                ActionPlayer.stop_action_group = False
+                self.current = request
+                if is_gait(request.name):
+                    request.extra = request.times - 1
+                    request.open = True
+            error = None
+            try:
+                if is_gait(request.name):
+                    ran = self.run_gait(request)
+                else:
+                    ran = ActionPlayer.runActionGroup(request.name, request.times, request.with_stand,
+                                                      request.lock_servos, request.speed)
+                if not ran:
+                    error = RuntimeError('动作组%s没有执行: 动作组文件不存在或其他线程正在执行动作' % request.name)
+            except BaseException as e:
+                print('动作组%s执行出错: %s' % (request.name, e))
+                error = e
+            with self.lock:
+                request.open = False
+                self.current = None
+                self.active -= 1
+                ActionPlayer.stop_action = False
+                ActionPlayer.stop_action_group = False
+            if error is not None:
+                request.future.set_exception(error)
+            else:
+                request.future.set_result(not request.preempted)
+
+# 默认动作执行线程
+action_executor = ActionExecutor()
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# coding=utf8
+# 步态分段：找出行走类动作组中周期性重复的部分，分为进入段、循环段和退出段，
+# 连续行走时只重复循环段，步与步之间不再回到立正姿态
+import os
+import numpy as np
+from ActionBlend import leg_servos
+from ActionGroupCache import write_d6a
+
+GAIT_TOLERANCE = 20   # 腿部舵机位置相差不超过该值时视为同一姿态
+MIN_LOOP_FRAMES = 2   # 循环段的最少帧数
+MIN_LOOP_MOTION = 50  # 循环段内腿部舵机的最小运动幅度，排除原地停顿
+
+# 分段保存的动作组名称后缀
+SEGMENT_SUFFIXES = ('_entry', '_loop', '_exit')
+
+def segment_names(actName):
+    return tuple(actName + suffix for suffix in SEGMENT_SUFFIXES)
+
+def pose_distance(frames, servos=leg_servos):
+    """
+    任意两帧之间的姿态距离
+
+    Returns:
+        int32数组，形状为(帧数, 帧数)，为两帧腿部舵机位置之差的最大值
+    """
+    legs = np.asarray(frames, dtype=np.int32)[:, servos]
+    return np.abs(legs[:, None, :] - legs[None, :, :]).max(axis=2)
+
+def find_loop(frames, tolerance=GAIT_TOLERANCE, min_frames=MIN_LOOP_FRAMES, min_motion=MIN_LOOP_MOTION):
+    """
+    找出一个周期：第start帧与第end帧姿态相同，start之前为起步，end及之后为收步
+
+    两帧姿态相同且下一帧也相同时才视为周期的起点，以排除左右腿交替时
+    在周期中间重复出现的过渡姿态；在所有满足条件的(start, end)中选择周期最短的，
+    相同时选择姿态距离最小、开始最早的
+
+    Returns:
+        (start, end)，没有找到周期时返回None
+    """
+    frames = np.asarray(frames, dtype=np.int32)
+    n = len(frames)
+    if n < min_frames + 2:
+        return None
+    dist = pose_distance(frames)
+    match = dist <= tolerance
+    candidate = np.zeros_like(match)
+    candidate[:-1, :-1] = match[:-1, :-1] & match[1:, 1:]
+    # 起步至少保留一帧
+    candidate[0] = False
+    i, j = np.nonzero(np.triu(candidate, min_frames))
+    if len(i) == 0:
+        return None
+
+    # 循环段内要有足够的运动
+    legs = frames[:, leg_servos]
+    motion = np.array([np.ptp(legs[a:b], axis=0).max() for a, b in zip(i.tolist(), j.tolist())])
+    keep = motion >= min_motion
+    i, j = i[keep], j[keep]
+    if len(i) == 0:
+        return None
+    order = np.lexsort((i, dist[i, j], j - i))
+    return int(i[order[0]]), int(j[order[0]])
+
+def get_loop(data):
+    """获取动作组的周期，与动作组数据一起缓存，动作组重新加载后重新查找"""
+    if data.loop is False:
+        data.loop = find_loop(data.frames)
+    return data.loop
+
+def split_gait(frames, times, loop):
+    """
+    按周期把动作组分为进入段、循环段和退出段
+
+    进入段为frames[:end]，循环段为frames[start:end]，退出段为frames[end:]。
+    依次运行进入段、循环段N次、退出段，N为0时与原动作组完全相同。
+    循环段第一帧从第end-1帧(与第start-1帧不同)过渡而来，运行时间使用第end帧的时间
+
+    Args:
+        loop: find_loop找到的(start, end)
+
+    Returns:
+        ((进入段帧, 时间), (循环段帧, 时间), (退出段帧, 时间))
+    """
+    start, end = loop
+    loop_times = np.array(times[start:end], dtype=np.uint32)
+    loop_times[0] = times[end]
+    return ((frames[:end], times[:end]),
+            (frames[start:end], loop_times),
+            (frames[end:], times[end:]))
+
+def save_segments(path, actName, segments):
+    """把分段保存为<动作组名>_entry.d6a、_loop.d6a和_exit.d6a"""
+    for name, (frames, times) in zip(segment_names(actName), segments):
+        write_d6a(os.path.join(path, name + '.d6a'), frames, times)
+
+def has_segments(cache, actName):
+    return all(cache.get(name) is not None for name in segment_names(actName))
+
+if __name__ == '__main__':
+    import sys
+    from ActionGroupCache import ActionGroupCache, action_path
+
+    # python3 ActionGait.py 动作组名称 [动作组名称 ...] [-d 动作组文件夹] [-n 只分析不保存]
+    args = sys.argv[1:]
+    path = action_path
+    save = True
+    if '-d' in args:
+        k = args.index('-d')
+        path = args[k + 1]
+        del args[k:k + 2]
+    if '-n' in args:
+        args.remove('-n')
+        save = False
+    cache = ActionGroupCache(path)
+    for actName in args or ['go_forward_fast', 'back_fast', 'left_move_fast', 'right_move_fast']:
+        data = cache.get(actName)
+        if data is None:
+            print('%-20s 未找到动作组文件' % actName)
+            continue
+        loop = find_loop(data.frames)
+        if loop is None:
+            print('%-20s 未找到周期，共%d帧' % (actName, data.frame_count))
+            continue
+        segments = split_gait(data.frames, data.times, loop)
+        print('%-20s 共%d帧，循环段为第%d~%d帧，每个周期%dms' % (
+              actName, data.frame_count, loop[0], loop[1] - 1, int(segments[1][1].sum())))
+        if save:
+            save_segments(path, actName, segments)
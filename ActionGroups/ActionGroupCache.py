@@ -0,0 +1,309 @@
+#!/usr/bin/python3
+# coding=utf8
+# 动作组缓存：启动时将ActionGroups目录下的.d6a动作组编译为NumPy数组常驻内存，
+# 避免每次运行动作组都重新打开SQLite文件。也可以从ActionBundle打包文件中读取
+import os
+import sqlite3 as sql
+import threading
+import numpy as np
+from ActionBundle import ActionBundle, write_bundle
+
+action_path = '/home/pi/TonyPi/ActionGroups/'
+bundle_path = action_path + 'ActionGroups.bundle'
+
+SERVO_NUM = 16
+
+class ActionGroupData:
+    """一个动作组的编译结果
+
+    frames: uint16数组，形状为(帧数, 16)，每行为16个总线舵机的目标位置
+    times: uint32数组，形状为(帧数,)，每帧的运行时间(毫秒)
+    """
+    __slots__ = ('name', 'frames', 'times', 'mtime', 'size', 'compiled', 'loop')
+
+    def __init__(self, name, frames, times, mtime=0, size=0):
+        self.name = name
+        self.frames = frames
+        self.times = times
+        self.mtime = mtime
+        self.size = size
+        self.compiled = None  # ActionCompiler编译的总线指令
+        self.loop = False     # ActionGait找到的周期(start, end)，没有周期时为None，False为还没有查找
+
+    @property
+    def frame_count(self):
+        return len(self.times)
+
+    @property
+    def total_time(self):
+        # 动作组总时长(毫秒)
+        return int(self.times.sum())
+
+def read_d6a(file_path):
+    """
+    读取.d6a动作组文件
+
+    Args:
+        file_path: .d6a文件路径
+
+    Returns:
+        (frames, times) 两个NumPy数组
+    """
+    ag = sql.connect(file_path)
+    try:
+        cu = ag.cursor()
+        columns = ', '.join('Servo%d' % (i + 1) for i in range(SERVO_NUM))
+        cu.execute('select Time, %s from ActionGroup order by [Index]' % columns)
+        rows = cu.fetchall()
+        cu.close()
+    finally:
+        ag.close()
+
+    data = np.array(rows, dtype=np.int64).reshape(-1, SERVO_NUM + 1)
+    times = data[:, 0].astype(np.uint32)
+    frames = np.ascontiguousarray(data[:, 1:], dtype=np.uint16)
+    return frames, times
+
+def write_d6a(file_path, frames, times):
+    """
+    写入.d6a动作组文件，格式与上位机保存的动作组相同
+
+    Args:
+        file_path: .d6a文件路径，文件已存在时覆盖
+        frames: 舵机位置，形状为(帧数, 16)
+        times: 每帧的运行时间(毫秒)
+    """
+    columns = ', '.join('Servo%d INT' % (i + 1) for i in range(SERVO_NUM))
+    rows = [[int(t)] + [int(p) for p in frame] for frame, t in zip(np.asarray(frames), np.asarray(times))]
+    tmp_path = file_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    ag = sql.connect(tmp_path)
+    try:
+        ag.execute('CREATE TABLE ActionGroup([Index] INTEGER PRIMARY KEY AUTOINCREMENT '
+                   'NOT NULL ON CONFLICT FAIL UNIQUE ON CONFLICT ABORT, Time INT, %s)' % columns)
+        ag.executemany('insert into ActionGroup(Time, %s) values (%s)' % (
+                           ', '.join('Servo%d' % (i + 1) for i in range(SERVO_NUM)),
+                           ', '.join('?' * (SERVO_NUM + 1))), rows)
+        ag.commit()
+    finally:
+        ag.close()
+    os.replace(tmp_path, file_path)
+
+class ActionGroupCache:
+    """
+    动作组缓存，按文件的修改时间和大小判断是否需要重新加载
+
+    打包文件存在时优先从打包文件读取，若某个.d6a文件比打包文件更新，则读取该.d6a文件
+
+    Args:
+        path: 动作组文件夹路径
+        bundle_path: 动作组打包文件路径，为None时只读取.d6a文件
+    """
+    def __init__(self, path=action_path, bundle_path=None):
+        self.path = path
+        self.bundle_path = bundle_path
+        self.bundle = None
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def file_path(self, name):
+        return os.path.join(self.path, name + '.d6a')
+
+    def get_bundle(self):
+        """打开打包文件，文件被替换后重新映射"""
+        if self.bundle_path is None:
+            return None
+        try:
+            st = os.stat(self.bundle_path)
+        except OSError:
+            self.bundle = None
+            return None
+
+        bundle = self.bundle
+        if bundle is not None and bundle.mtime == st.st_mtime and bundle.size == st.st_size:
+            return bundle
+        try:
+            bundle = ActionBundle(self.bundle_path)
+        except (OSError, ValueError) as e:
+            print('动作组打包文件加载失败: %s' % e)
+            bundle = None
+        with self.lock:
+            # 丢弃引用旧打包文件的缓存条目
+            old = self.bundle
+            if old is not None:
+                self.groups = {k: v for k, v in self.groups.items()
+                               if v.mtime != old.mtime or v.size != old.size}
+            self.bundle = bundle
+        return bundle
+
+    def load(self, name):
+        """从.d6a文件加载动作组，不检查缓存"""
+        file_path = self.file_path(name)
+        st = os.stat(file_path)
+        frames, times = read_d6a(file_path)
+        data = ActionGroupData(name, frames, times, st.st_mtime, st.st_size)
+        with self.lock:
+            self.groups[name] = data
+        return data
+
+    def get(self, name):
+        """
+        获取动作组，文件被修改后会自动重新加载
+
+        Returns:
+            ActionGroupData，动作组文件不存在时返回None
+        """
+        try:
+            st = os.stat(self.file_path(name))
+        except OSError:
+            st = None
+
+        bundle = self.get_bundle()
+        if bundle is not None and name in bundle and (st is None or st.st_mtime <= bundle.mtime):
+            data = self.groups.get(name)
+            if data is not None and data.mtime == bundle.mtime and data.size == bundle.size:
+                return data
+            frames, times = bundle.get(name)
+            data = ActionGroupData(name, frames, times, bundle.mtime, bundle.size)
+            with self.lock:
+                self.groups[name] = data
+            return data
+
+        if st is None:
+            with self.lock:
+                self.groups.pop(name, None)
+            return None
+
+        data = self.groups.get(name)
+        if data is not None and data.mtime == st.st_mtime and data.size == st.st_size:
+            return data
+        return self.load(name)
+
+    def names(self):
+        """列出动作组文件夹和打包文件中所有的动作组名称"""
+        try:
+            files = os.listdir(self.path)
+        except OSError:
+            files = []
+        names = set(f[:-4] for f in files if f.endswith('.d6a'))
+        bundle = self.get_bundle()
+        if bundle is not None:
+            names.update(bundle.names())
+        return sorted(names)
+
+    def preload(self, names=None):
+        """
+        预先编译动作组，默认编译文件夹中的全部动作组
+
+        Returns:
+            成功加载的动作组数量
+        """
+        count = 0
+        for name in (self.names() if names is None else names):
+            try:
+                if self.get(name) is not None:
+                    count += 1
+            except Exception as e:
+                print('动作组%s加载失败: %s' % (name, e))
+        return count
+
+    def clear(self):
+        with self.lock:
+            self.groups.clear()
+
+    def pack(self, out_path=None, names=None):
+        """
+        将.d6a动作组打包成一个文件，默认打包文件夹中的全部动作组
+
+        Returns:
+            打包的动作组数量
+        """
+        out_path = out_path or self.bundle_path or os.path.join(self.path, 'ActionGroups.bundle')
+        if names is None:
+            try:
+                names = sorted(f[:-4] for f in os.listdir(self.path) if f.endswith('.d6a'))
+            except OSError:
+                names = []
+        groups = {}
+        for name in names:
+            try:
+                groups[name] = read_d6a(self.file_path(name))
+            except Exception as e:
+                print('动作组%s读取失败: %s' % (name, e))
+        write_bundle(out_path, groups)
+        return len(groups)
+
+# 默认缓存实例
+action_cache = ActionGroupCache(action_path, bundle_path)
+
+def get_action(name):
+    return action_cache.get(name)
+
+def preload(names=None):
+    return action_cache.preload(names)
+
+def benchmark(path=action_path, repeat=200):
+    """比较.d6a文件和打包文件的冷启动时间和单次加载时间"""
+    import time
+
+    names = ActionGroupCache(path).names()
+    if not names:
+        print('没有找到动作组文件')
+        return
+    out_path = os.path.join(path, 'benchmark.bundle')
+    ActionGroupCache(path).pack(out_path, names)
+
+    try:
+        # 冷启动：加载全部动作组
+        t = time.perf_counter()
+        for name in names:
+            read_d6a(os.path.join(path, name + '.d6a'))
+        d6a_cold = time.perf_counter() - t
+
+        t = time.perf_counter()
+        bundle = ActionBundle(out_path)
+        for name in names:
+            bundle.get(name)
+        bundle_cold = time.perf_counter() - t
+
+        # 单次加载：对应不使用缓存时每次runAction的开销
+        t = time.perf_counter()
+        for i in range(repeat):
+            for name in names:
+                read_d6a(os.path.join(path, name + '.d6a'))
+        d6a_call = (time.perf_counter() - t) / (repeat * len(names))
+
+        t = time.perf_counter()
+        for i in range(repeat):
+            for name in names:
+                bundle.get(name)
+        bundle_call = (time.perf_counter() - t) / (repeat * len(names))
+        bundle.close()
+    finally:
+        os.remove(out_path)
+
+    print('动作组数量: %d' % len(names))
+    print('冷启动   .d6a: %8.3fms   打包文件: %8.3fms' % (d6a_cold * 1000, bundle_cold * 1000))
+    print('单次加载 .d6a: %8.1fus   打包文件: %8.1fus' % (d6a_call * 1e6, bundle_call * 1e6))
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    # python3 ActionGroupCache.py [list|pack|bench] [动作组文件夹]
+    cmd = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    path = sys.argv[2] if len(sys.argv) > 2 else action_path
+    if cmd == 'pack':
+        n = ActionGroupCache(path).pack(os.path.join(path, 'ActionGroups.bundle'))
+        print('已打包%d个动作组' % n)
+    elif cmd == 'bench':
+        benchmark(path)
+    else:
+        cache = ActionGroupCache(path, os.path.join(path, 'ActionGroups.bundle'))
+        t = time.time()
+        n = cache.preload()
+        print('编译%d个动作组，用时%.1fms' % (n, (time.time() - t) * 1000))
+        for name in sorted(cache.groups):
+            data = cache.groups[name]
+            print('%-24s 帧数: %3d  时长: %6dms' % (name, data.frame_count, data.total_time))
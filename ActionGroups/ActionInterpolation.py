@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# coding=utf8
+# 动作组插值：在关键帧之间按固定的舵机周期重新采样，支持变速播放和舵机限速
+import numpy as np
+
+SERVO_MIN = 0
+SERVO_MAX = 1000
+
+def keyframe_times(times, speed=1.0):
+    """每个关键帧到达的时刻(毫秒)，第0帧的时刻为从当前姿态运动到第0帧所用的时间"""
+    return np.cumsum(np.asarray(times, dtype=np.float64)) / speed
+
+def hermite_slopes(t, p):
+    """
+    计算各关键帧处的切线斜率，相邻两段斜率方向相反时斜率为0，
+    并限制斜率大小，保证插值曲线在两个关键帧之间单调，不会超出关键帧的范围
+    """
+    n = len(t)
+    m = np.zeros_like(p)
+    if n < 3:
+        return m
+    dt = np.diff(t)[:, None]
+    dp = np.diff(p, axis=0)
+    d = np.divide(dp, dt, out=np.zeros_like(dp), where=dt > 0)
+    d0, d1 = d[:-1], d[1:]
+    mid = (d0 + d1) / 2
+    limit = 3 * np.minimum(np.abs(d0), np.abs(d1))
+    mid = np.clip(mid, -limit, limit)
+    mid[d0 * d1 <= 0] = 0
+    m[1:-1] = mid
+    return m
+
+def interpolate(t, p, ts, method='linear'):
+    """
+    在时刻ts处对关键帧插值
+
+    Args:
+        t: 关键帧时刻，形状为(N,)
+        p: 关键帧舵机位置，形状为(N, 舵机数)
+        ts: 采样时刻，形状为(M,)
+        method: 'linear'线性插值或'cubic'三次Hermite插值
+
+    Returns:
+        采样结果，形状为(M, 舵机数)，float64
+    """
+    p = np.asarray(p, dtype=np.float64)
+    if len(t) == 1:
+        return np.repeat(p, len(ts), axis=0)
+
+    i = np.clip(np.searchsorted(t, ts, side='right') - 1, 0, len(t) - 2)
+    t0, t1 = t[i], t[i + 1]
+    h = t1 - t0
+    u = np.divide(ts - t0, h, out=np.ones_like(ts), where=h > 0)
+    u = np.clip(u, 0.0, 1.0)[:, None]
+    p0, p1 = p[i], p[i + 1]
+
+    if method == 'linear':
+        return p0 + (p1 - p0) * u
+    elif method == 'cubic':
+        m = hermite_slopes(t, p)
+        h = h[:, None]
+        u2 = u * u
+        u3 = u2 * u
+        return ((2 * u3 - 3 * u2 + 1) * p0 + (u3 - 2 * u2 + u) * h * m[i] +
+                (-2 * u3 + 3 * u2) * p1 + (u3 - u2) * h * m[i + 1])
+    else:
+        raise ValueError('不支持的插值方式: %s' % method)
+
+def limit_velocity(samples, tick, max_velocity, max_extra=500):
+    """
+    限制每个舵机的最大速度，跟不上的舵机会在动作末尾追加周期直到到达最终位置
+
+    Args:
+        samples: 采样结果，形状为(M, 舵机数)
+        tick: 采样周期(毫秒)
+        max_velocity: 最大速度(舵机位置单位/秒)，可以是一个数或每个舵机一个值的数组
+        max_extra: 最多追加的周期数
+
+    Returns:
+        限速后的采样结果
+    """
+    step = np.broadcast_to(np.asarray(max_velocity, dtype=np.float64) * tick / 1000.0,
+                           samples.shape[1:])
+    out = [samples[0]]
+    cur = samples[0]
+    for target in samples[1:]:
+        cur = cur + np.clip(target - cur, -step, step)
+        out.append(cur)
+    final = samples[-1]
+    for i in range(max_extra):
+        if np.all(np.abs(final - cur) < 0.5):
+            break
+        cur = cur + np.clip(final - cur, -step, step)
+        out.append(cur)
+    return np.array(out)
+
+def resample(frames, times, tick=20, speed=1.0, method='linear', max_velocity=None):
+    """
+    将动作组重新采样为固定周期的帧序列
+
+    第0帧保持原有的运行时间(除以speed)，用于从当前姿态过渡到动作起始姿态，
+    之后每tick毫秒输出一帧
+
+    Args:
+        frames: 关键帧舵机位置，形状为(N, 舵机数)
+        times: 关键帧运行时间(毫秒)，形状为(N,)
+        tick: 舵机周期(毫秒)
+        speed: 播放速度倍数，大于1为加快
+        method: 'linear'或'cubic'
+        max_velocity: 舵机最大速度(舵机位置单位/秒)，None为不限速
+
+    Returns:
+        (frames, times)，格式与动作组相同，可直接播放
+    """
+    if speed <= 0:
+        raise ValueError('speed必须大于0')
+    frames = np.asarray(frames)
+    t = keyframe_times(times, speed)
+    t_start, t_end = t[0], t[-1]
+
+    ts = np.arange(t_start + tick, t_end, tick, dtype=np.float64)
+    ts = np.append(ts, t_end) if t_end > t_start else ts
+    samples = interpolate(t, frames, np.concatenate(([t_start], ts)), method)
+    if max_velocity is not None:
+        samples = limit_velocity(samples, tick, max_velocity)
+
+    out_times = np.full(len(samples), tick, dtype=np.uint32)
+    out_times[0] = int(round(t_start))
+    if len(ts) and len(samples) == len(ts) + 1:
+        # 最后一帧的周期可能不足tick
+        last = int(round(ts[-1] - (ts[-2] if len(ts) > 1 else t_start)))
+        out_times[-1] = max(last, 1)
+    out_frames = np.clip(np.rint(samples), SERVO_MIN, SERVO_MAX).astype(np.uint16)
+    return out_frames, out_times
@@ -0,0 +1,435 @@
+#!/usr/bin/python3
+# coding=utf8
+# 动作组播放：接口与hiwonder.ActionGroupControl保持一致，
+# 动作数据从ActionGroupCache读取，不再每次打开.d6a文件
+import threading
+import numpy as np
+import hiwonder.Board as Board
+from ActionGroupCache import action_cache, SERVO_NUM
+from ActionDelta import DEADBAND, PACKET_SIZE
+from ActionCompiler import CompiledAction, get_compiled
+from ActionInterpolation import resample
+from ActionRegistry import go_actions, back_actions, start_actions, gait_directions
+from ActionScheduler import FrameScheduler
+from ActionGait import segment_names, split_gait, get_loop
+
+try:
+    import hiwonder.BusServoCmd as BusServoCmd
+    # 直接写串口，每帧一次write
+    use_compiled = hasattr(BusServoCmd, 'serialHandle') and hasattr(BusServoCmd, 'portWrite')
+except ImportError:
+    BusServoCmd = None
+    use_compiled = False
+
+runningAction = False
+stop_action = False
+stop_action_group = False
+
+run_lock = threading.Lock()
+
+deadband = DEADBAND  # 舵机位置变化不超过该值时不发送指令，为-1时每帧发送全部舵机
+last_pose = None     # 最近一次发送给各舵机的位置
+bus_stats = {}       # 动作组名称 -> [全部发送的字节数, 实际发送的字节数]
+scheduler = FrameScheduler()  # 按绝对时刻发送每一帧，scheduler.report()查看延迟统计
+loop_cache = {}      # (动作组名称, 速度) -> (分段来源, 进入段, 循环段, 退出段)
+
+def stopAction():
+    global stop_action
+    stop_action = True
+
+def check_stop():
+    global stop_action
+    if stop_action:
+        stop_action = False
+        print('stop')
+        return True
+    return False
+
+def stopActionGroup():
+    global stop_action_group
+    stop_action_group = True
+
+def preload(names=None):
+    """启动时预先编译动作组，并找出没有分段动作组的步态的周期"""
+    count = action_cache.preload(names)
+    for name in gait_directions:
+        parts = gait_parts(name)
+        if parts is not None and len(parts) == 1:
+            get_loop(parts[0])
+    return count
+
+def reset_pose():
+    """
+    舵机位置未知时(例如直接通过Board控制舵机、舵机重新上电)调用，下一帧发送全部舵机。
+    每个动作组开始时也会调用，死区只在一个动作组之内生效
+    """
+    global last_pose
+    last_pose = None
+
+resetPose = reset_pose  # 兼容旧的名称
+
+def bus_write(buf):
+    BusServoCmd.portWrite()
+    BusServoCmd.serialHandle.write(buf)
+
+def play_compiled(compiled, lock_servos='', stop=check_stop):
+    """
+    播放编译好的动作组，每帧一次总线写入，可被stopAction打断
+
+    Args:
+        stop: 返回True时停止播放
+
+    Returns:
+        (全部发送的字节数, 实际发送的字节数)
+    """
+    global last_pose
+
+    if lock_servos or not use_compiled:
+        return play_frames_board(compiled.frames, compiled.times, lock_servos, stop)
+
+    buffers = compiled.buffers
+    poses = compiled.poses
+    sent = [0]
+    start_pose = last_pose
+
+    def send(i, last):
+        if last == i - 1 and last >= 0:
+            buf = buffers[i]
+        else:
+            # 第一帧或跳帧之后，从当前位置直接到达第i帧
+            buf = compiled.transition_buffer(start_pose if last < 0 else poses[last], i)
+        bus_write(buf)
+        sent[0] += len(buf)
+
+    last = scheduler.play(compiled.times, send, stop)
+    if last >= 0:
+        last_pose = poses[last].copy()
+    full_size = compiled.packets.shape[1] * PACKET_SIZE
+    return (last + 1) * full_size, sent[0]
+
+def play_frames(frames, times, lock_servos='', stop=check_stop):
+    """
+    逐帧发送舵机位置，可被stopAction打断，
+    只向位置与上次发送相比变化超过死区的舵机发送指令
+
+    Args:
+        frames: 舵机位置，形状为(帧数, 16)
+        times: 每帧的运行时间(毫秒)
+        lock_servos: 不需要运动的舵机编号
+        stop: 返回True时停止播放
+
+    Returns:
+        (全部发送的字节数, 实际发送的字节数)
+    """
+    if lock_servos or not use_compiled:
+        return play_frames_board(frames, [t / 1000.0 for t in times.tolist()], lock_servos, stop)
+    return play_compiled(CompiledAction(frames, times, deadband), stop=stop)
+
+def play_frames_board(frames, times, lock_servos='', stop=check_stop):
+    """
+    通过Board.setBusServoPulse逐个舵机发送，用于锁定部分舵机或无法直接写串口的情况
+
+    Args:
+        frames: 舵机位置，形状为(帧数, 16)
+        times: 每帧的运行时间(秒)
+        lock_servos: 不需要运动的舵机编号
+        stop: 返回True时停止播放
+    """
+    global last_pose
+
+    unlocked = np.array([str(i + 1) not in lock_servos for i in range(SERVO_NUM)])
+    if last_pose is None:
+        sent = np.full(SERVO_NUM, -1000, dtype=np.int32)
+    else:
+        sent = last_pose.copy()
+    count = [0, 0]
+
+    def send(i, last):
+        target = np.asarray(frames[i], dtype=np.int32)
+        changed = (np.abs(target - sent) > deadband) & unlocked
+        ms = int(round(times[i] * 1000))
+        for j in np.flatnonzero(changed).tolist():
+            Board.setBusServoPulse(j + 1, int(target[j]), ms)
+        sent[changed] = target[changed]
+        count[0] += int(unlocked.sum()) * PACKET_SIZE
+        count[1] += int(changed.sum()) * PACKET_SIZE
+
+    scheduler.play(times, send, stop)
+    last_pose = sent
+    return count[0], count[1]
+
+def add_bus_stats(name, stats):
+    total = bus_stats.setdefault(name, [0, 0])
+    total[0] += stats[0]
+    total[1] += stats[1]
+
+def runAction(actName, lock_servos='', speed=1.0):
+    '''
+    运行动作组，无法发送stop停止信号
+    :param actName: 动作组名字，字符串类型
+    :param lock_servos: 不需要运动的舵机编号
+    :param speed: 播放速度倍数，不为1时按插值后的帧序列运行
+    :return: 是否执行了动作组，动作组文件不存在或其他线程正在执行动作时返回False
+    '''
+    return runActionScaled(actName, speed=speed, lock_servos=lock_servos, interpolate=speed != 1.0)
+
+def runActionScaled(actName, speed=1.0, tick=20, method='linear', max_velocity=None,
+                    lock_servos='', interpolate=True):
+    '''
+    按插值后的帧序列运行动作组
+    :param actName: 动作组名字，字符串类型
+    :param speed: 播放速度倍数，例如1.2为加快20%
+    :param tick: 插值后的舵机周期(毫秒)
+    :param method: 插值方式，'linear'或'cubic'
+    :param max_velocity: 舵机最大速度(舵机位置单位/秒)，可为每个舵机一个值的列表
+    :param lock_servos: 不需要运动的舵机编号
+    :param interpolate: 为False时按原始关键帧运行
+    :return: 是否执行了动作组，动作组文件不存在或其他线程正在执行动作时返回False
+    '''
+    global runningAction
+
+    if actName is None:
+        return False
+
+    if action_cache.get(actName) is None:
+        runningAction = False
+        print("未能找到动作组文件")
+        return False
+
+    if not run_lock.acquire(False):
+        print("正在执行其他动作，忽略动作组: %s" % actName)
+        return False
+    runningAction = True
+    reset_pose()
+    try:
+        return play_action(actName, speed, tick, method, max_velocity, lock_servos, interpolate)
+    finally:
+        runningAction = False
+        run_lock.release()
+
+def play_action(actName, speed=1.0, tick=20, method='linear', max_velocity=None,
+                lock_servos='', interpolate=None, stop=check_stop):
+    """
+    播放动作组，调用者需要已经持有run_lock，参数与runActionScaled相同
+
+    Args:
+        interpolate: 为None时与runAction相同，速度不为1时才插值
+        stop: 返回True时停止播放
+
+    Returns:
+        动作组文件不存在时返回False
+    """
+    data = action_cache.get(actName)
+    if data is None:
+        return False
+    if interpolate is None:
+        interpolate = speed != 1.0
+    if interpolate:
+        frames, times = resample(data.frames, data.times, tick, speed, method, max_velocity)
+        add_bus_stats(actName, play_frames(frames, times, lock_servos, stop))
+    else:
+        add_bus_stats(actName, play_compiled(get_compiled(data, deadband), lock_servos, stop))
+    return True
+
+def runFrames(frames, times, lock_servos=''):
+    '''
+    运行一段帧序列，例如ActionBlend拼接好的动作序列
+    :param frames: 舵机位置，形状为(帧数, 16)
+    :param times: 每帧的运行时间(毫秒)
+    :param lock_servos: 不需要运动的舵机编号
+    '''
+    global runningAction
+
+    if not run_lock.acquire(False):
+        return
+    runningAction = True
+    reset_pose()
+    try:
+        add_bus_stats('frames', play_frames(frames, times, lock_servos))
+    finally:
+        runningAction = False
+        run_lock.release()
+
+def compile_segment(frames, times, speed):
+    if speed != 1.0:
+        frames, times = resample(frames, times, speed=speed)
+    return CompiledAction(frames, times, deadband)
+
+def gait_parts(actName):
+    """
+    步态的分段来源：ActionGait保存的分段动作组，或行走类动作组的起步、行走和收步动作组，
+    都没有时为动作组本身
+    """
+    parts = [action_cache.get(name) for name in segment_names(actName)]
+    if None not in parts:
+        return parts
+    if actName in go_actions or actName in back_actions:
+        end_action = 'go_forward_end' if actName in go_actions else 'back_end'
+        parts = [action_cache.get(name) for name in (start_actions[actName], actName, end_action)]
+        if None not in parts:
+            return parts
+    data = action_cache.get(actName)
+    if data is None or data.frame_count < 3:
+        return None
+    return [data]
+
+def get_loop_segments(actName, speed=1.0):
+    """
+    把步态分为进入段、循环段和退出段并编译，没有分段动作组时按find_loop找到的周期分段
+
+    Returns:
+        (进入段, 循环段, 退出段)，动作组不存在或找不到首尾姿态相同的周期时返回None
+    """
+    parts = gait_parts(actName)
+    if parts is None:
+        return None
+    key = (actName, speed)
+    cached = loop_cache.get(key)
+    if cached is not None and cached[0] == parts:
+        return cached[1:]
+    if len(parts) == 1:
+        loop = get_loop(parts[0])
+        if loop is None:
+            return None
+        split = split_gait(parts[0].frames, parts[0].times, loop)
+    else:
+        split = [(data.frames, data.times) for data in parts]
+    segments = tuple(compile_segment(frames, times, speed) for frames, times in split)
+    loop_cache[key] = (parts,) + segments
+    return segments
+
+def runActionLoop(actName, more, cut=None, lock_servos='', speed=1.0):
+    '''
+    运行动作组，每个循环结束时more()返回True则再循环一次循环段，不回到首尾的立正姿态，
+    用于连续收到的同一步态指令
+    :param actName: 动作组名字，字符串类型
+    :param more: 是否继续循环
+    :param cut: 每个循环结束时检查，返回True时不再循环，直接执行退出段；不打断正在执行的一步，
+                避免从迈步中途的姿态直接跳到退出段
+    :param lock_servos: 不需要运动的舵机编号
+    :param speed: 播放速度倍数
+    :return: 循环次数，没有执行时(动作组文件不存在或其他线程正在执行动作)为0，被stopAction打断时返回-1
+    '''
+    global runningAction
+
+    segments = get_loop_segments(actName, speed)
+    if segments is None:
+        # 找不到首尾姿态相同的周期时整段重复，避免在姿态不连续处循环
+        count = 0
+        while True:
+            if not runAction(actName, lock_servos, speed):
+                return count
+            count += 1
+            if not more():
+                return count
+
+    if not run_lock.acquire(False):
+        return 0
+    runningAction = True
+    reset_pose()
+    stopped = [False]
+
+    def stop():
+        if check_stop():
+            stopped[0] = True
+            return True
+        return False
+
+    try:
+        entry, loop, exit = segments
+        count = 1
+        add_bus_stats(actName, play_compiled(entry, lock_servos, stop))
+        while not stopped[0] and not (cut is not None and cut()) and more():
+            add_bus_stats(actName, play_compiled(loop, lock_servos, stop))
+            count += 1
+        if stopped[0]:
+            return -1
+        add_bus_stats(actName, play_compiled(exit, lock_servos))
+        return count
+    finally:
+        runningAction = False
+        run_lock.release()
+
+def runGait(actName, cycles=1, lock_servos='', speed=1.0):
+    '''
+    连续行走cycles个周期，只在开始和结束时经过立正姿态
+    :param actName: 动作组名字，字符串类型
+    :param cycles: 周期数
+    :param lock_servos: 不需要运动的舵机编号
+    :param speed: 播放速度倍数
+    '''
+    remaining = [cycles - 1]
+
+    def more():
+        remaining[0] -= 1
+        return remaining[0] >= 0
+
+    return runActionLoop(actName, more, None, lock_servos, speed)
+
+__end = False
+__start = True
+current_status = ''
+def runActionGroup(actName, times=1, with_stand=False, lock_servos='', speed=1.0):
+    '''
+    运行动作组，times为0时循环运行，直到调用stopActionGroup
+    :param actName: 动作组名字，字符串类型
+    :param times: 运行次数
+    :param with_stand: 行走类动作结束后是否执行收步动作
+    :param lock_servos: 不需要运动的舵机编号
+    :param speed: 播放速度倍数
+    :return: 是否执行了动作组，动作组文件不存在或其他线程正在执行动作时返回False
+    '''
+    global __end
+    global __start
+    global current_status
+    global stop_action_group
+
+    ran = True
+    temp = times
+    while True:
+        if temp != 0:
+            times -= 1
+        try:
+            if (actName not in go_actions and actName not in back_actions) or stop_action_group:
+                if __end:
+                    __end = False
+                    if current_status == 'go':
+                        runAction('go_forward_end', lock_servos, speed)
+                    else:
+                        runAction('back_end', lock_servos, speed)
+                if stop_action_group:
+                    __end = False
+                    __start = True
+                    stop_action_group = False
+                    break
+                __start = True
+                if times < 0:
+                    __end = False
+                    __start = True
+                    stop_action_group = False
+                    break
+                if not runAction(actName, lock_servos, speed):
+                    ran = False
+                    break
+            else:
+                if times < 0:
+                    if with_stand:
+                        if actName in go_actions:
+                            runAction('go_forward_end', lock_servos, speed)
+                        else:
+                            runAction('back_end', lock_servos, speed)
+                    break
+                if __start:
+                    if not runAction(start_actions[actName], lock_servos, speed):
+                        ran = False
+                        break
+                    __start = False
+                    __end = True
+                    current_status = 'go' if actName in go_actions else 'back'
+                elif not runAction(actName, lock_servos, speed):
+                    ran = False
+                    break
+        except BaseException as e:
+            print(e)
+            ran = False
+    return ran
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# coding=utf8
+# 动作组时长表：根据ActionGroupDict中的动作组预先计算每个动作组的时长、帧数和起止姿态，
+# 用于预测动作序列的完成时间，语音播报和动作可以据此并行安排，不必固定等待
+import time
+from ActionGroupDict import action_group_dict
+from ActionGroupCache import action_cache
+
+# 行走类动作组需要先执行起步动作，停止时执行收步动作
+go_actions = ('go_forward', 'go_forward_fast', 'go_forward_slow')
+back_actions = ('back', 'back_fast')
+start_actions = {
+    'go_forward': 'go_forward_start',
+    'go_forward_fast': 'go_forward_start_fast',
+    'go_forward_slow': 'go_forward_start',
+    'back': 'back_start',
+    'back_fast': 'back_start',
+}
+
+# 步态类动作组：连续收到相同的指令时循环中间一段，不必每次从立正开始
+gait_directions = {
+    'go_forward': 'forward',
+    'go_forward_fast': 'forward',
+    'go_forward_slow': 'forward',
+    'back': 'back',
+    'back_fast': 'back',
+    'left_move': 'left',
+    'left_move_fast': 'left',
+    'right_move': 'right',
+    'right_move_fast': 'right',
+    'turn_left': 'turn_left',
+    'turn_right': 'turn_right',
+    'stepping': 'stepping',
+}
+opposite_directions = {
+    'forward': 'back',
+    'back': 'forward',
+    'left': 'right',
+    'right': 'left',
+    'turn_left': 'turn_right',
+    'turn_right': 'turn_left',
+}
+
+def is_gait(actName):
+    return actName in gait_directions
+
+def is_opposite(actName1, actName2):
+    """两个步态类动作组的方向是否相反"""
+    direction = gait_directions.get(actName1)
+    return direction is not None and opposite_directions.get(direction) == gait_directions.get(actName2)
+
+def expand_action(actName, times=1, with_stand=True):
+    '''
+    从立正状态调用runActionGroup(actName, times, with_stand)时实际运行的动作组列表，
+    行走类动作组第一次运行的是起步动作，结束时运行收步动作
+    '''
+    if actName in go_actions or actName in back_actions:
+        names = [start_actions[actName]] + [actName] * (times - 1)
+        if with_stand:
+            names.append('go_forward_end' if actName in go_actions else 'back_end')
+        return names
+    return [actName] * times
+
+class ActionInfo:
+    """
+    动作组的时长信息
+
+    duration: 总时长(毫秒)
+    frame_count: 帧数
+    start_pose, end_pose: 第一帧和最后一帧的舵机位置
+    """
+    __slots__ = ('name', 'duration', 'frame_count', 'start_pose', 'end_pose', 'data')
+
+    def __init__(self, data):
+        self.name = data.name
+        self.duration = data.total_time
+        self.frame_count = data.frame_count
+        self.start_pose = data.frames[0] if data.frame_count else None
+        self.end_pose = data.frames[-1] if data.frame_count else None
+        self.data = data
+
+class ActionRegistry:
+    """
+    动作组时长表，动作组文件被修改后自动更新
+
+    Args:
+        cache: 动作组缓存
+        action_dict: 动作编号到动作组名称的字典
+    """
+    def __init__(self, cache=action_cache, action_dict=action_group_dict):
+        self.cache = cache
+        self.action_dict = action_dict
+        self.infos = {}
+
+    def build(self):
+        """预先计算字典中全部动作组(包括行走类的起步和收步动作)的时长"""
+        for actName in self.action_dict.values():
+            for name in set(expand_action(actName, 2)):
+                self.get(name)
+        return len(self.infos)
+
+    def get(self, name):
+        """
+        Returns:
+            ActionInfo，动作组不存在时返回None
+        """
+        data = self.cache.get(name)
+        if data is None:
+            self.infos.pop(name, None)
+            return None
+        info = self.infos.get(name)
+        if info is None or info.data is not data:
+            info = ActionInfo(data)
+            self.infos[name] = info
+        return info
+
+    def name_of(self, action_id):
+        return self.action_dict.get(str(action_id))
+
+    def duration(self, actName, times=1, with_stand=True, speed=1.0):
+        """
+        runActionGroup(actName, times, with_stand)的预计用时(秒)，未知的动作组按0计算
+        """
+        total = 0
+        for name in expand_action(actName, times, with_stand):
+            info = self.get(name)
+            if info is not None:
+                total += info.duration
+        return total / 1000.0 / speed
+
+    def sequence_duration(self, action_names, gap=0.0):
+        """
+        依次执行多个动作组的预计用时(秒)
+
+        Args:
+            action_names: 动作组名称列表
+            gap: 动作之间的停顿时间(秒)
+        """
+        total = sum(self.duration(name) for name in action_names)
+        return total + gap * max(len(action_names) - 1, 0)
+
+    def predict_completion(self, action_names, start_time=None, gap=0.0):
+        """
+        预测动作序列的完成时刻，与time.monotonic()可直接比较
+
+        Args:
+            action_names: 动作组名称列表
+            start_time: 开始时刻，默认为当前时刻
+            gap: 动作之间的停顿时间(秒)
+        """
+        if start_time is None:
+            start_time = time.monotonic()
+        return start_time + self.sequence_duration(action_names, gap)
+
+# 默认时长表
+action_registry = ActionRegistry()
+
+if __name__ == '__main__':
+    action_registry.build()
+    for action_id, name in sorted(action_group_dict.items(), key=lambda x: int(x[0])):
+        info = action_registry.get(name)
+        if info is None:
+            print('%3s %-24s 未找到动作组文件' % (action_id, name))
+        else:
+            print('%3s %-24s 帧数: %3d  时长: %6dms' % (action_id, name, info.frame_count, info.duration))
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# coding=utf8
+# 帧调度：按绝对时刻发送每一帧，sleep的误差不会累积，
+# 落后时跳过已经过期的帧，保证动作组按时完成
+import time
+import threading
+
+# 延迟直方图的分组上限(毫秒)，最后一组为超过100ms
+LATENESS_BINS = (1, 2, 5, 10, 20, 50, 100)
+
+class FrameScheduler:
+    """
+    帧调度器，统计每一帧实际发送时刻相对于计划时刻的延迟
+
+    Args:
+        bins: 延迟直方图的分组上限(毫秒)
+    """
+    def __init__(self, bins=LATENESS_BINS):
+        self.bins = bins
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.hist = [0] * (len(self.bins) + 1)
+            self.sent = 0
+            self.dropped = 0
+            self.max_late = 0.0
+
+    def record(self, late):
+        ms = late * 1000
+        i = 0
+        while i < len(self.bins) and ms >= self.bins[i]:
+            i += 1
+        with self.lock:
+            self.hist[i] += 1
+            self.sent += 1
+            self.max_late = max(self.max_late, ms)
+
+    def play(self, times, send, stop=None):
+        """
+        按计划时刻依次发送每一帧
+
+        第i帧的计划时刻为开始时刻加上前i帧的运行时间之和。发送前如果已经过了下一帧的
+        计划时刻，则跳过当前帧(最后一帧总是发送)
+
+        Args:
+            times: 每帧的运行时间(秒)
+            send: send(i, last)发送第i帧，last为上一次发送的帧，没有时为-1
+            stop: 返回True时停止播放
+
+        Returns:
+            最后发送的帧，没有发送任何帧时为-1
+        """
+        n = len(times)
+        deadlines = [0.0] * (n + 1)
+        start = time.monotonic()
+        t = start
+        for i in range(n):
+            deadlines[i] = t
+            t += times[i]
+        deadlines[n] = t
+
+        last = -1
+        i = 0
+        while i < n:
+            if stop is not None and stop():
+                break
+            now = time.monotonic()
+            while i < n - 1 and now >= deadlines[i + 1]:
+                i += 1
+                with self.lock:
+                    self.dropped += 1
+            self.record(max(now - deadlines[i], 0.0))
+            send(i, last)
+            last = i
+            i += 1
+            remaining = deadlines[i] - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+        return last
+
+    def report(self):
+        """延迟直方图的文字说明"""
+        labels = []
+        low = 0
+        for high in self.bins:
+            labels.append('%d-%dms' % (low, high))
+            low = high
+        labels.append('>%dms' % low)
+        lines = ['发送%d帧，跳过%d帧，最大延迟%.1fms' % (self.sent, self.dropped, self.max_late)]
+        for label, count in zip(labels, self.hist):
+            lines.append('%8s: %d' % (label, count))
+        return '\n'.join(lines)
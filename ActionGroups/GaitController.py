@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+# coding=utf8
+# 步态控制：接收连续的速度指令(vx, vy, yaw)，在每一步结束时选择下一步的步态和速度，
+# 方向不变时只重复循环段，方向改变时执行退出段后进入新的步态
+import time
+import threading
+import ActionPlayer
+
+# 方向 -> 步态动作组
+GAIT_TABLE = {
+    'forward': 'go_forward_fast',
+    'back': 'back_fast',
+    'left': 'left_move_fast',
+    'right': 'right_move_fast',
+    'turn_left': 'turn_left',
+    'turn_right': 'turn_right',
+}
+
+DEAD_ZONE = 0.1       # 速度指令的绝对值不超过该值时视为0
+MIN_SPEED = 0.8       # 速度指令刚超过死区时的播放速度倍数
+MAX_SPEED = 1.2       # 速度指令为1时的播放速度倍数
+SPEED_STEP = 0.1      # 播放速度按该值取整，减少需要编译的速度档位
+COMMAND_TIMEOUT = 0.5 # 超过该时间(秒)没有新的速度指令时停止
+
+def clamp(value, low=-1.0, high=1.0):
+    return max(low, min(high, value))
+
+def select_direction(vx, vy, yaw, dead_zone=DEAD_ZONE):
+    """
+    选择绝对值最大的分量作为运动方向
+
+    Args:
+        vx: 前进速度，正为前进，负为后退
+        vy: 横移速度，正为左移，负为右移
+        yaw: 转向速度，正为左转，负为右转
+
+    Returns:
+        (方向, 速度大小)，都在死区内时返回(None, 0)
+    """
+    axes = ((abs(vx), 'forward' if vx > 0 else 'back'),
+            (abs(vy), 'left' if vy > 0 else 'right'),
+            (abs(yaw), 'turn_left' if yaw > 0 else 'turn_right'))
+    magnitude, direction = max(axes, key=lambda a: a[0])
+    if magnitude <= dead_zone:
+        return None, 0.0
+    return direction, min(magnitude, 1.0)
+
+def gait_speed(magnitude, dead_zone=DEAD_ZONE, min_speed=MIN_SPEED, max_speed=MAX_SPEED, step=SPEED_STEP):
+    """速度大小在死区到1之间线性对应到min_speed~max_speed，按step取整"""
+    k = (magnitude - dead_zone) / (1.0 - dead_zone) if dead_zone < 1.0 else 1.0
+    speed = min_speed + (max_speed - min_speed) * clamp(k, 0.0, 1.0)
+    return round(round(speed / step) * step, 3)
+
+class GaitController:
+    """
+    步态控制器
+
+    set_velocity()只更新速度指令，立即返回；控制线程在每一步结束时读取最新的指令，
+    因此指令可以按视觉的帧率更新，机器人按步的节奏响应
+
+    Args:
+        gaits: 方向到步态动作组的字典
+        dead_zone: 速度指令的死区
+        timeout: 超过该时间(秒)没有新的速度指令时停止，为None时不检查
+    """
+    def __init__(self, gaits=GAIT_TABLE, dead_zone=DEAD_ZONE, timeout=COMMAND_TIMEOUT):
+        self.gaits = gaits
+        self.dead_zone = dead_zone
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.command = (0.0, 0.0, 0.0)
+        self.stamp = 0.0
+        self.current = None  # 正在执行的步态动作组
+        self.steps = 0       # 执行的步数(循环段次数)
+        self.thread = threading.Thread(target=self.worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def set_velocity(self, vx=0.0, vy=0.0, yaw=0.0):
+        """
+        设置速度指令，各分量范围为-1~1
+
+        Args:
+            vx: 前进速度，正为前进，负为后退
+            vy: 横移速度，正为左移，负为右移
+            yaw: 转向速度，正为左转，负为右转
+        """
+        with self.lock:
+            self.command = (clamp(vx), clamp(vy), clamp(yaw))
+            self.stamp = time.monotonic()
+        self.event.set()
+
+    def stop(self):
+        """在当前一步结束后执行退出段并停止"""
+        self.set_velocity(0.0, 0.0, 0.0)
+
+    def wait_idle(self, timeout=None):
+        """等待当前步态执行完退出段，返回是否已停止"""
+        return self.idle.wait(timeout)
+
+    def target(self):
+        """
+        当前速度指令对应的步态
+
+        Returns:
+            (步态动作组, 播放速度倍数)，停止时返回(None, 0)
+        """
+        with self.lock:
+            vx, vy, yaw = self.command
+            stamp = self.stamp
+        if self.timeout is not None and time.monotonic() - stamp > self.timeout:
+            return None, 0.0
+        direction, magnitude = select_direction(vx, vy, yaw, self.dead_zone)
+        if direction is None:
+            return None, 0.0
+        return self.gaits.get(direction), gait_speed(magnitude, self.dead_zone)
+
+    def run_gait(self, name, speed):
+        """执行一个步态直到指令改变，返回是否被stopAction打断"""
+        segments = ActionPlayer.get_loop_segments(name, speed)
+        stopped = [False]
+
+        def stop():
+            if ActionPlayer.check_stop():
+                stopped[0] = True
+                return True
+            return False
+
+        ActionPlayer.add_bus_stats(name, ActionPlayer.play_compiled(segments[0], stop=stop))
+        while not stopped[0]:
+            next_name, next_speed = self.target()
+            if next_name != name:
+                break
+            if next_speed != speed:
+                # 速度改变时只更换循环段，各段的姿态相同
+                loop = ActionPlayer.get_loop_segments(name, next_speed)
+                if loop is not None:
+                    speed = next_speed
+                    segments = loop
+            ActionPlayer.add_bus_stats(name, ActionPlayer.play_compiled(segments[1], stop=stop))
+            self.steps += 1
+        if stopped[0]:
+            return True
+        ActionPlayer.add_bus_stats(name, ActionPlayer.play_compiled(segments[2]))
+        return False
+
+    def run_clip(self, name, speed):
+        """整段执行一次动作组，返回是否被stopAction打断"""
+        stopped = [False]
+
+        def stop():
+            if ActionPlayer.check_stop():
+                stopped[0] = True
+                return True
+            return False
+
+        if ActionPlayer.play_action(name, speed=speed, stop=stop) and not stopped[0]:
+            self.steps += 1
+        return stopped[0]
+
+    def worker(self):
+        while True:
+            self.event.wait()
+            self.event.clear()
+            name, speed = self.target()
+            if name is None:
+                continue
+            segments = ActionPlayer.get_loop_segments(name, speed)
+            if segments is None and ActionPlayer.action_cache.get(name) is None:
+                print('未能找到步态动作组: %s' % name)
+                time.sleep(COMMAND_TIMEOUT)
+                continue
+            self.idle.clear()
+            with ActionPlayer.run_lock:
+                ActionPlayer.runningAction = True
+                ActionPlayer.reset_pose()
+                self.current = name
+                try:
+                    if segments is None:
+                        # 找不到周期时整段运行动作组，每一步都回到首尾的姿态
+                        if self.run_clip(name, speed):
+                            self.stop()
+                    elif self.run_gait(name, speed):
+                        # 被打断后等待新的指令
+                        self.stop()
+                except BaseException as e:
+                    print('步态%s执行出错: %s' % (name, e))
+                finally:
+                    self.current = None
+                    ActionPlayer.runningAction = False
+            self.idle.set()
+            # 执行期间收到的指令在下一次循环处理
+            self.event.set()
+
+# 默认步态控制器，第一次使用时才创建，导入本模块时不启动控制线程
+gait_controller = None
+gait_controller_lock = threading.Lock()
+
+def get_gait_controller():
+    global gait_controller
+    with gait_controller_lock:
+        if gait_controller is None:
+            gait_controller = GaitController()
+        return gait_controller
@@ -9,8 +9,9 @@ from ActionGroupDict import *
 import hiwonder.TTS as TTS
 import hiwonder.ASR as ASR
 import hiwonder.Board as Board
-import hiwonder.ActionGroupControl as AGC
 import hiwonder.yaml_handle as yaml_handle
+import ActionPlayer
+from ActionExecutor import action_executor
 
 # 语音控制初始化
 servo_data = yaml_handle.get_yaml_data(yaml_handle.servo_file_path)
@@ -53,11 +54,14 @@ try:
     asr.addWords(24, 'li zheng')
     asr.addWords(25, 'ta bu')
 
+    # 预先编译动作组
+    ActionPlayer.preload()
+
     # 舵机初始化
     data = asr.getResult()
     Board.setPWMServoPulse(1, 1500, 500)
     Board.setPWMServoPulse(2, servo_data['servo2'], 500)
-    AGC.runActionGroup('stand')
+    ActionPlayer.runActionGroup('stand')
     action_finish = True
     tts.TTSModuleSpeak('[h0][v10][m3]', '我准备好了')
 
@@ -103,7 +107,8 @@ while True:
             action_name = action_group_dict[str(data - 1)]
             print(f'执行动作: {action_name}')
             tts.TTSModuleSpeak('', '好的')
-            AGC.runActionGroup(action_name, 1, True)
+            # 交给动作执行线程，新指令打断正在执行的动作并先恢复站立
+            action_executor.submit(action_name, 1, True, preempt=True, stand=True)
         except KeyError:
             print(f'无对应动作: {data - 1}')
             tts.TTSModuleSpeak('', 'Unknown Command')
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# coding=utf8
+# 色块提取：用cv2.connectedComponentsWithStats一次得到所有颜色所有色块的面积、外接矩形和中心，
+# 筛选和找最大色块都用NumPy完成，耗时不随掩码中噪点的多少变化
+import cv2
+import numpy as np
+
+# 多种颜色的掩码左右拼接后一起计算，中间留出的空白宽度。
+# 3x3的腐蚀膨胀最多向两边各扩展1列，留3列时相邻颜色的色块不会连在一起
+BLOB_GAP = 3
+
+# 色块信息：颜色序号、面积(像素数)、外接矩形、中心
+BLOB_DTYPE = np.dtype([
+    ('color', np.int32),
+    ('area', np.int32),
+    ('x', np.int32),
+    ('y', np.int32),
+    ('w', np.int32),
+    ('h', np.int32),
+    ('cx', np.float32),
+    ('cy', np.float32),
+])
+
+def stack_masks(masks, gap=BLOB_GAP):
+    """把多个相同大小的掩码左右拼接，中间留出gap列空白"""
+    if len(masks) == 1:
+        return masks[0]
+    h, w = masks[0].shape[:2]
+    stride = w + gap
+    image = np.zeros((h, stride * len(masks) - gap), dtype=np.uint8)
+    for k, mask in enumerate(masks):
+        image[:, k * stride:k * stride + w] = mask
+    return image
+
+def find_blobs(masks, min_area=0, kernel=None, gap=BLOB_GAP):
+    """
+    找出所有掩码中的全部色块
+
+    Args:
+        masks: 掩码列表，每种颜色一个，大小相同
+        min_area: 面积小于该值的色块忽略
+        kernel: 不为None时先用该结构元素腐蚀再膨胀，去除噪点
+        gap: 拼接掩码时中间的空白宽度
+
+    Returns:
+        BLOB_DTYPE数组，color为色块所在掩码的序号，坐标为在该掩码中的坐标
+    """
+    if len(masks) == 0:
+        # 没有需要识别的颜色
+        return np.empty(0, dtype=BLOB_DTYPE)
+    h, w = masks[0].shape[:2]
+    stride = w + gap
+    image = stack_masks(masks, gap)
+    if kernel is not None:
+        image = cv2.dilate(cv2.erode(image, kernel), kernel)
+    # 色块最多为像素数的1/4，不超过65535时用16位的标签图，速度更快
+    ltype = cv2.CV_16U if image.size // 4 < 65535 else cv2.CV_32S
+    count, _, stats, centroids = cv2.connectedComponentsWithStats(image, connectivity=8, ltype=ltype)
+
+    # 第0个为背景
+    stats = stats[1:]
+    centroids = centroids[1:]
+    if min_area > 0:
+        keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+        stats = stats[keep]
+        centroids = centroids[keep]
+
+    blobs = np.empty(len(stats), dtype=BLOB_DTYPE)
+    color = stats[:, cv2.CC_STAT_LEFT] // stride
+    offset = color * stride
+    blobs['color'] = color
+    blobs['area'] = stats[:, cv2.CC_STAT_AREA]
+    blobs['x'] = stats[:, cv2.CC_STAT_LEFT] - offset
+    blobs['y'] = stats[:, cv2.CC_STAT_TOP]
+    blobs['w'] = stats[:, cv2.CC_STAT_WIDTH]
+    blobs['h'] = stats[:, cv2.CC_STAT_HEIGHT]
+    blobs['cx'] = centroids[:, 0] - offset
+    blobs['cy'] = centroids[:, 1]
+    return blobs
+
+def max_blob(blobs, color=None):
+    """
+    面积最大的色块
+
+    Args:
+        color: 不为None时只在该颜色的色块中查找
+
+    Returns:
+        色块(BLOB_DTYPE的一条记录)，没有色块时返回None
+    """
+    if color is not None:
+        blobs = blobs[blobs['color'] == color]
+    if len(blobs) == 0:
+        return None
+    return blobs[np.argmax(blobs['area'])]
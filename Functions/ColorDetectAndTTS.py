@@ -1,6 +1,8 @@
 #!/usr/bin/python3
 # coding=utf8
 import sys
+sys.path.append('/home/pi/TonyPi/')
+
 import cv2
 import math
 import time
@@ -9,9 +11,13 @@ import numpy as np
 import hiwonder.TTS as TTS
 import hiwonder.Misc as Misc
 import hiwonder.Board as Board
-import hiwonder.Camera as Camera
 import hiwonder.ActionGroupControl as AGC
 import hiwonder.yaml_handle as yaml_handle
+from Functions.ColorLUT import ColorLUT
+from Functions.ColorBlob import find_blobs, max_blob, stack_masks
+from Functions.Undistort import Undistorter, load_maps
+from Functions.FrameGrabber import open_camera
+from Functions.ColorVote import ColorVote
 
 # 颜色检测
 
@@ -33,48 +39,30 @@ range_rgb = {
 
 lab_data = None
 servo_data = None
+color_lut = ColorLUT()  # 颜色阈值改变时才重新生成
 def load_config():
     global lab_data, servo_data
     
     lab_data = yaml_handle.get_yaml_data(yaml_handle.lab_file_path)
     servo_data = yaml_handle.get_yaml_data(yaml_handle.servo_file_path)
-
-# 找出面积最大的轮廓
-# 参数为要比较的轮廓的列表
-def getAreaMaxContour(contours):
-    contour_area_temp = 0
-    contour_area_max = 0
-    area_max_contour = None
-
-    for c in contours:  # 历遍所有轮廓
-        contour_area_temp = math.fabs(cv2.contourArea(c))  # 计算轮廓面积
-        if contour_area_temp > contour_area_max:
-            contour_area_max = contour_area_temp
-            if contour_area_temp > 50:  # 只有在面积大于50时，最大面积的轮廓才是有效的，以过滤干扰
-                area_max_contour = c
-
-    return area_max_contour, contour_area_max  # 返回最大的轮廓
+    color_lut.build(lab_data)
 
 # 初始位置
 def initMove():
     Board.setPWMServoPulse(1, 1500, 500)
     Board.setPWMServoPulse(2, servo_data['servo2'], 500)
 
-color_list = []
+color_vote = ColorVote(('red', 'green', 'blue'))  # 最近几帧按色块面积加权投票
 detect_color = 'None'
 action_finish = True
-draw_color = range_rgb["black"]
 # 变量重置
 def reset():
-    global draw_color
-    global color_list
     global detect_color
     global action_finish
     
-    color_list = []
+    color_vote.reset()
     detect_color = 'None'
     action_finish = True
-    draw_color = range_rgb["black"]
     
 # app初始化调用
 def init():
@@ -109,7 +97,6 @@ color_dict = {'red': '红色',
         }
 
 def move():
-    global draw_color
     global detect_color
     global action_finish
     
@@ -128,7 +115,6 @@ def move():
                 tts.TTSModuleSpeak(speaker, '检测到' + color_dict[detect_color])
                 time.sleep(2)
                 detect_color = 'None'
-                draw_color = range_rgb["black"]
             else:
                 time.sleep(0.01)
         else:
@@ -140,125 +126,111 @@ th.setDaemon(True)
 th.start()
 
 size = (320, 240)
-def run(img):
-    global draw_color
-    global color_list
+kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+undistorter = None  # 不为None时run()中对原图做畸变矫正并缩小
+display_frame = None  # 与undistorter一起使用，矫正缩小后的画面放大到原尺寸，标记画在上面
+# 矫正缩小后的画面和滤波后的画面
+frame_resize = np.empty((size[1], size[0], 3), dtype=np.uint8)
+frame_gb = np.empty((size[1], size[0], 3), dtype=np.uint8)
+def run(img, out=None, annotate=True):
+    """
+    识别画面中面积最大的色块，按投票结果确定要播报的颜色
+
+    Args:
+        img: 相机画面
+        out: 画标记的图像，为None时画在img上(有undistorter时画在display_frame上)
+        annotate: 为False时不画标记
+
+    Returns:
+        画好标记的图像
+    """
     global detect_color
     global action_finish
     
-    img_copy = img.copy()
     img_h, img_w = img.shape[:2]
+    if undistorter is not None:
+        undistorter.remap(img, frame_resize)  # 畸变矫正和缩小用一次remap完成
+    if annotate and undistorter is not None:
+        # 色块坐标为矫正后画面中的坐标，标记画在放大到原尺寸的矫正画面上，不再矫正整帧
+        out = cv2.resize(frame_resize, (img_w, img_h), dst=display_frame if out is None or out is img else out,
+                         interpolation=cv2.INTER_LINEAR)
+    elif annotate and out is not None and out is not img:
+        np.copyto(out, img)
+    else:
+        out = img
 
     if not __isRunning:
-        return img
+        return out
 
-    frame_resize = cv2.resize(img_copy, size, interpolation=cv2.INTER_NEAREST)
-    frame_gb = cv2.GaussianBlur(frame_resize, (3, 3), 3)      
-    frame_lab = cv2.cvtColor(frame_gb, cv2.COLOR_BGR2LAB)  # 将图像转换到LAB空间
+    if undistorter is None:
+        cv2.resize(img, size, dst=frame_resize, interpolation=cv2.INTER_NEAREST)
+    cv2.GaussianBlur(frame_resize, (3, 3), 3, dst=frame_gb)
+    labels = color_lut.classify(frame_gb)  # 查表得到每个像素属于哪些颜色
 
-    max_area = 0
-    color_area_max = None    
-    areaMaxContour_max = 0
-    
     if action_finish:
-        for i in lab_data:
-            if i != 'black' and i != 'white':
-                frame_mask = cv2.inRange(frame_lab,
-                                         (lab_data[i]['min'][0],
-                                          lab_data[i]['min'][1],
-                                          lab_data[i]['min'][2]),
-                                         (lab_data[i]['max'][0],
-                                          lab_data[i]['max'][1],
-                                          lab_data[i]['max'][2]))  #对原图像和掩模进行位运算
-                eroded = cv2.erode(frame_mask, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))  #腐蚀
-                dilated = cv2.dilate(eroded, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))) #膨胀
-                if debug:
-                    cv2.imshow(i, dilated)
-                contours = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]  #找出轮廓
-                areaMaxContour, area_max = getAreaMaxContour(contours)  #找出最大轮廓
-                if areaMaxContour is not None:
-                    if area_max > max_area:#找最大面积
-                        max_area = area_max
-                        color_area_max = i
-                        areaMaxContour_max = areaMaxContour
-        if max_area > 200:  # 有找到最大面积
-            ((centerX, centerY), radius) = cv2.minEnclosingCircle(areaMaxContour_max)  # 获取最小外接圆
-            centerX = int(Misc.map(centerX, 0, size[0], 0, img_w))
-            centerY = int(Misc.map(centerY, 0, size[1], 0, img_h))
-            radius = int(Misc.map(radius, 0, size[0], 0, img_w))            
-            cv2.circle(img, (centerX, centerY), radius, range_rgb[color_area_max], 2)#画圆
-
-            if color_area_max == 'red':  #红色最大
-                color = 1
-            elif color_area_max == 'green':  #绿色最大
-                color = 2
-            elif color_area_max == 'blue':  #蓝色最大
-                color = 3
-            else:
-                color = 0
-            color_list.append(color)
-
-            if len(color_list) == 5:  #多次判断
-                # 取平均值
-                color = int(round(np.mean(np.array(color_list))))
-                color_list = []
-                if color == 1:
-                    detect_color = 'red'
-                    draw_color = range_rgb["red"]
-                elif color == 2:
-                    detect_color = 'green'
-                    draw_color = range_rgb["green"]
-                elif color == 3:
-                    detect_color = 'blue'
-                    draw_color = range_rgb["blue"]
-                else:
-                    detect_color = 'None'
-                    draw_color = range_rgb["black"]               
+        # 各颜色的掩码拼接后一起腐蚀膨胀并提取色块，面积不足50的色块无效
+        names = [i for i in lab_data if i != 'black' and i != 'white']
+        masks = [color_lut.mask(labels, i) for i in names]
+        blobs = find_blobs(masks, 50, kernel)
+        if debug and masks:
+            cv2.imshow('mask', stack_masks(masks))
+        blob = max_blob(blobs)  # 所有颜色中面积最大的色块
+        if blob is not None and blob['area'] > 200:  # 有找到最大面积
+            color_area_max = names[blob['color']]
+            # 外接矩形的中心和外接圆半径
+            centerX = int(Misc.map(blob['x'] + blob['w'] / 2.0, 0, size[0], 0, img_w))
+            centerY = int(Misc.map(blob['y'] + blob['h'] / 2.0, 0, size[1], 0, img_h))
+            radius = int(Misc.map(math.hypot(blob['w'], blob['h']) / 2.0, 0, size[0], 0, img_w))
+            if annotate:
+                cv2.circle(out, (centerX, centerY), radius, range_rgb[color_area_max], 2)#画圆
+            # 按面积加权投票，红绿蓝以外的颜色视为没有找到
+            color = color_vote.update(color_area_max, int(blob['area']))
         else:
-            detect_color = 'None'
-            draw_color = range_rgb["black"]
+            color = color_vote.update(None)
+        if color is not None:  # 有颜色的票数超过阈值，播报
+            detect_color = color
             
-    cv2.putText(img, "Color: " + detect_color, (10, img.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.65, draw_color, 2)
+    if annotate:
+        stable_color = color_vote.current if color_vote.current is not None else 'None'
+        cv2.putText(out, "Color: " + stable_color, (10, out.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.65,
+                    range_rgb.get(stable_color, range_rgb["black"]), 2)
     
-    return img
+    return out
 
 if __name__ == '__main__':
     from CameraCalibration.CalibrationConfig import *
     
-    #加载参数
-    param_data = np.load(calibration_param_path + '.npz')
-
-    #获取参数
-    mtx = param_data['mtx_array']
-    dist = param_data['dist_array']
-    newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (640, 480), 0, (640, 480))
-    mapx, mapy = cv2.initUndistortRectifyMap(mtx, dist, None, newcameramtx, (640, 480), 5)
+    use_undistort = True  # 畸变矫正和缩小在run()中用一次remap完成
+    if use_undistort:
+        undistorter = Undistorter(calibration_param_path, size)
+        display_frame = np.empty((480, 640, 3), dtype=np.uint8)
+    else:
+        #加载畸变矫正映射表，标定参数不变时直接读取缓存
+        mapx, mapy = load_maps(calibration_param_path, (640, 480), m1type=cv2.CV_32FC1)
+        undistorted = np.empty((480, 640, 3), dtype=np.uint8)  # 矫正后的画面，每帧重复使用
     
     debug = False
+    show_frame = True  # 没有显示器时设为False，不画标记也不显示画面
     if debug:
         print('Debug Mode')
         
     init()
     start()
-    open_once = yaml_handle.get_yaml_data('/boot/camera_setting.yaml')['open_once']
-    if open_once:
-        my_camera = cv2.VideoCapture('http://127.0.0.1:8080/?action=stream?dummy=param.mjpg')
-    else:
-        my_camera = Camera.Camera()
-        my_camera.camera_open() 
+    my_camera = open_camera()  # 取帧线程，总是取得最新的一帧
     AGC.runActionGroup('stand')
     tts.TTSModuleSpeak('[h0][v10][m3]', '我准备好了')
+    seq = 0
     while True:
-        ret, img = my_camera.read()
-        if img is not None:
-            frame = img.copy()
-            frame = cv2.remap(frame, mapx, mapy, cv2.INTER_LINEAR)  # 畸变矫正
-            Frame = run(frame)
-            cv2.imshow('Frame', Frame)
-            key = cv2.waitKey(1)
-            if key == 27:
-                break
-        else:
-            time.sleep(0.01)
+        # frame为取帧线程的缓冲区，在下一次取帧前不会被改写，不需要复制
+        seq, stamp, frame = my_camera.latest(seq)
+        if frame is not None:
+            if not use_undistort:
+                frame = cv2.remap(frame, mapx, mapy, cv2.INTER_LINEAR, dst=undistorted)  # 畸变矫正
+            Frame = run(frame, annotate=show_frame)
+            if show_frame:
+                cv2.imshow('Frame', Frame)
+                key = cv2.waitKey(1)
+                if key == 27:
+                    break
     my_camera.camera_close()
     cv2.destroyAllWindows()
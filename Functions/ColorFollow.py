@@ -1,19 +1,26 @@
 #!/usr/bin/python3
 # coding=utf8
 import sys
+sys.path.append('/home/pi/TonyPi/')
+
 import cv2
 import time
-import math
 import threading
 import numpy as np
-import pandas as pd
 from hiwonder.PID import PID
 import hiwonder.Misc as Misc
-import hiwonder.Board as Board
-import hiwonder.Camera as Camera
-import hiwonder.ActionGroupControl as AGC
 import hiwonder.yaml_handle as yaml_handle
+import ActionPlayer
+from ActionExecutor import action_executor
+from GaitController import GaitController
 from CameraCalibration.CalibrationConfig import *
+from Functions.ColorLUT import ColorLUT
+from Functions.ColorBlob import find_blobs, max_blob
+from Functions.Undistort import Undistorter
+from Functions.FrameGrabber import open_camera
+from Functions.RadiusFilter import RadiusFilter
+from Functions.TargetPredictor import TargetPredictor
+from Functions.HeadServo import HeadServo
 
 #跟随 
 
@@ -23,15 +30,6 @@ if sys.version_info.major == 2:
     print('Please run this program with python3!')
     sys.exit(0)
 
-#加载参数
-param_data = np.load(calibration_param_path + '.npz')
-
-#获取参数
-mtx = param_data['mtx_array']
-dist = param_data['dist_array']
-newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (640, 480), 0, (640, 480))
-mapx, mapy = cv2.initUndistortRectifyMap(mtx, dist, None, newcameramtx, (640, 480), 5)
-
 range_rgb = {
     'red': (0, 0, 255),
     'blue': (255, 0, 0),
@@ -42,11 +40,13 @@ range_rgb = {
 
 lab_data = None
 servo_data = None
+color_lut = ColorLUT()  # 颜色阈值改变时才重新生成
 def load_config():
     global lab_data, servo_data
     
     lab_data = yaml_handle.get_yaml_data(yaml_handle.lab_file_path)
     servo_data = yaml_handle.get_yaml_data(yaml_handle.servo_file_path)
+    color_lut.build(lab_data)
 
 __target_color = ('green',)
 # 设置检测颜色
@@ -56,10 +56,10 @@ def setBallTargetColor(target_color):
     __target_color = target_color
     return (True, ())
 
+head_servo = HeadServo()  # 云台舵机指令合并、死区和限频
 # 初始位置
 def initMove():
-    Board.setPWMServoPulse(1, servo_data['servo1'], 500)
-    Board.setPWMServoPulse(2, servo_data['servo2'], 500)
+    head_servo.move(servo_data['servo1'], servo_data['servo2'], 500)
 
 load_config()
 
@@ -80,6 +80,7 @@ def reset():
     global x_dis, y_dis
     global __target_color
     global centerX, centerY
+    global track_target, track_misses
 
     d_x = 20
     d_y = 20
@@ -91,11 +92,15 @@ def reset():
     start_count = True
     __target_color = ()
     centerX, centerY = -2, -2
+    track_target = None
+    track_misses = 0
+    predictor.reset()
     
 # app初始化调用
 def init():
     print("Follow Init")
     load_config()
+    ActionPlayer.preload()
     initMove()
 
 __isRunning = False
@@ -110,179 +115,224 @@ def start():
 def stop():
     global __isRunning
     __isRunning = False
+    follow_gait.stop()
+    action_executor.preempt()
     print("Follow Stop")
 
 # app退出玩法调用
 def exit():
     global __isRunning
     __isRunning = False
-    AGC.runActionGroup('stand_slow')
+    follow_gait.stop()
+    follow_gait.wait_idle(5)
+    action_executor.submit('stand_slow', preempt=True)
+    print('云台舵机指令: %s' % head_servo.stats())
     print("Follow Exit")
 
-# 找出面积最大的轮廓
-# 参数为要比较的轮廓的列表
-def getAreaMaxContour(contours):
-    contour_area_temp = 0
-    contour_area_max = 0
-    area_max_contour = None
-
-    for c in contours:  # 历遍所有轮廓
-        contour_area_temp = math.fabs(cv2.contourArea(c))  # 计算轮廓面积
-        if contour_area_temp > contour_area_max:
-            contour_area_max = contour_area_temp
-            if contour_area_temp >= 100:  # 只有在面积大于设定值时，最大面积的轮廓才是有效的，以过滤干扰
-                area_max_contour = c
-
-    return area_max_contour, contour_area_max  # 返回最大的轮廓
-
 CENTER_X = 320
 circle_radius = 0
-#执行动作组
+TARGET_RADIUS = 140  # 目标的半径在100~180之间时不前后移动
+LATERAL_SCALE = 300  # 横向偏差(像素+云台舵机位置)除以该值为横移速度指令
+RADIUS_SCALE = 120   # 半径偏差除以该值为前后速度指令
+follow_gait = GaitController(dead_zone=1/3.0)  # 死区对应原来100像素、40半径的阈值
+#根据目标位置计算速度指令(vx, vy, yaw)
+def velocity_command():
+    target = predictor.predict(time.monotonic())  # 当前时刻目标的位置和半径
+    if centerX < 0 or target is None or target[2] <= 0:
+        return 0.0, 0.0, 0.0
+    target_x, target_y, radius = target
+    # 目标在左边或云台向左转时为正，向左移
+    lateral = (x_dis - servo_data['servo2']) - (target_x - CENTER_X)
+    vy = lateral / LATERAL_SCALE
+    vx = (TARGET_RADIUS - radius) / RADIUS_SCALE
+    if abs(vy) > follow_gait.dead_zone:  # 不在中心时先横移对准
+        vx = 0.0
+    return vx, vy, 0.0
+
+#更新速度指令，步态控制线程在每一步结束时按最新的指令选择下一步，不阻塞视觉循环
 def move():
+    if not __isRunning:
+        return
+    follow_gait.set_velocity(*velocity_command())
+
+CENTER_Y = 240
+predictor = TargetPredictor()  # 根据画面的采集时间预测目标的位置和半径
+head_event = threading.Event()  # 有新的目标位置时置位
+#云台跟踪，在单独的线程中执行，不阻塞视觉循环。
+#每有新的目标位置，按预测的当前时刻的位置更新PID，舵机指令由head_servo合并后发送
+def head_track():
+    global x_dis, y_dis
     
     while True:
-        if __isRunning:
-            if centerX >= 0:
-                if centerX - CENTER_X > 100 or x_dis - servo_data['servo2'] < -100:  # 不在中心，根据方向让机器人转向一步
-                    AGC.runActionGroup('right_move_fast')
-                elif centerX - CENTER_X < -100 or x_dis - servo_data['servo2'] > 100:
-                    AGC.runActionGroup('left_move_fast')                        
-                elif 100 > circle_radius > 0:
-                    AGC.runActionGroup('go_forward_fast')
-                elif 180 < circle_radius:
-                    AGC.runActionGroup('back_fast')
-            else:
-                time.sleep(0.01)
-        else:
-            time.sleep(0.01)
+        head_event.wait()
+        head_event.clear()
+        if not __isRunning:
+            continue
+        target = predictor.predict(time.monotonic())
+        if target is None:
+            continue
+        target_x, target_y, radius = target
+        
+        x_pid.SetPoint = CENTER_X #设定           
+        x_pid.update(target_x) #当前
+        dx = int(x_pid.output)
+        use_time = abs(dx*0.00025)
+        x_dis += dx #输出           
+        
+        x_dis = servo_data['servo2'] - 400 if x_dis < servo_data['servo2'] - 400 else x_dis          
+        x_dis = servo_data['servo2'] + 400 if x_dis > servo_data['servo2'] + 400 else x_dis
+            
+        y_pid.SetPoint = CENTER_Y
+        y_pid.update(target_y)
+        dy = int(y_pid.output)
+        use_time = round(max(use_time, abs(dy*0.00025)), 5)
+        y_dis += dy
+        
+        y_dis = servo_data['servo1'] if y_dis < servo_data['servo1'] else y_dis
+        y_dis = 2000 if y_dis > 2000 else y_dis    
+        
+        head_servo.move(y_dis, x_dis, use_time*1000)
 
-#启动动作的线程
-th = threading.Thread(target=move)
+th = threading.Thread(target=head_track)
 th.setDaemon(True)
 th.start()
 
-radius_data = []
+radius_filter = RadiusFilter(5)  # 最近5次半径去除离群值后的平均
 size = (320, 240)
-def run(img):
-    global radius_data
-    global x_dis, y_dis
+kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+use_undistort = False  # 为True时对画面做畸变矫正，按处理分辨率生成映射表
+undistorter = Undistorter(calibration_param_path, size) if use_undistort else None
+# 畸变矫正时矫正缩小后的画面放大到原尺寸，标记画在上面
+display_frame = np.empty((480, 640, 3), dtype=np.uint8) if use_undistort else None
+# 缩小和滤波后的画面，跟踪时只写入搜索窗口对应的部分
+frame_resize = np.empty((size[1], size[0], 3), dtype=np.uint8)
+frame_gb = np.empty((size[1], size[0], 3), dtype=np.uint8)
+
+use_tracking = True   # 找到目标后只在目标周围的搜索窗口中查找，找不到时恢复全图查找
+TRACK_SCALE = 1.5     # 搜索窗口的半宽为目标宽度(circle_radius)的倍数
+TRACK_MIN_SIZE = 24   # 搜索窗口的最小半宽(处理图像的像素)
+TRACK_MAX_MISSES = 3  # 搜索窗口中连续找不到目标的帧数达到该值时恢复全图查找
+track_target = None   # 上一次找到目标的中心(原图坐标)，为None时全图查找
+track_misses = 0
+#上一次目标位置周围的搜索窗口(x0, y0, x1, y1)，为处理图像的坐标，需要全图查找时返回None
+def search_window(img_w, img_h):
+    if not use_tracking or track_target is None or circle_radius <= 0:
+        return None
+    cx = track_target[0] * size[0] / img_w
+    cy = track_target[1] * size[1] / img_h
+    half = max(TRACK_MIN_SIZE, circle_radius * TRACK_SCALE * size[0] / img_w)
+    x0, x1 = max(0, int(cx - half)), min(size[0], int(cx + half) + 1)
+    y0, y1 = max(0, int(cy - half)), min(size[1], int(cy + half) + 1)
+    if (x1 - x0) * (y1 - y0) * 2 > size[0] * size[1]:  # 窗口超过半幅画面时直接全图查找
+        return None
+    return x0, y0, x1, y1
+
+def run(img, out=None, annotate=True, stamp=None):
+    """
+    在搜索窗口(或全图)中找出目标颜色面积最大的色块，更新目标位置的预测并选择步态
+
+    Args:
+        img: 相机画面
+        out: 画标记的图像，为None时画在img上(有undistorter时画在display_frame上)
+        annotate: 为False时不画标记
+        stamp: 画面的采集时间(time.monotonic())，为None时取当前时间
+
+    Returns:
+        画好标记的图像
+    """
     global centerX, centerY, circle_radius
+    global track_target, track_misses
     
-    img_copy = img.copy()
     img_h, img_w = img.shape[:2]
+    if annotate and undistorter is not None:
+        # 色块坐标为矫正后画面中的坐标，标记画在放大到原尺寸的矫正画面上，
+        # 显示时整幅画面都要矫正缩小，搜索窗口直接取其中的一部分
+        undistorter.remap(img, frame_resize)
+        out = cv2.resize(frame_resize, (img_w, img_h), dst=display_frame if out is None or out is img else out,
+                         interpolation=cv2.INTER_LINEAR)
+    elif annotate and out is not None and out is not img:
+        np.copyto(out, img)
+    else:
+        out = img
     
     if not __isRunning or __target_color == ():
-        return img
-    
-    frame_resize = cv2.resize(img_copy, size, interpolation=cv2.INTER_NEAREST)
-    frame_gb = cv2.GaussianBlur(frame_resize, (3, 3), 3)   
-    frame_lab = cv2.cvtColor(frame_gb, cv2.COLOR_BGR2LAB)  # 将图像转换到LAB空间
+        return out
     
-    area_max = 0
-    areaMaxContour = 0
+    window = search_window(img_w, img_h)
+    x0, y0, x1, y1 = window if window is not None else (0, 0, size[0], size[1])
+    # 只处理搜索窗口内的部分，全图查找时窗口即为整幅图像
+    if annotate and undistorter is not None:
+        roi_resize = frame_resize[y0:y1, x0:x1]
+    elif undistorter is not None:
+        roi_resize = undistorter.remap(img, frame_resize[y0:y1, x0:x1], window)  # 畸变矫正和缩小用一次remap完成
+    else:
+        sx, sy = img_w / float(size[0]), img_h / float(size[1])
+        roi_resize = cv2.resize(img[int(y0 * sy):int(y1 * sy), int(x0 * sx):int(x1 * sx)], (x1 - x0, y1 - y0),
+                                dst=frame_resize[y0:y1, x0:x1], interpolation=cv2.INTER_NEAREST)
+    roi_gb = cv2.GaussianBlur(roi_resize, (3, 3), 3, dst=frame_gb[y0:y1, x0:x1])
+    labels = color_lut.classify(roi_gb)  # 查表得到每个像素属于哪些颜色
     
-    frame_mask_combined = None  # 创建合并的掩码
+    blob = None
+    if color_lut.bit(__target_color):
+        frame_mask = color_lut.mask(labels, __target_color)  # 所有目标颜色合并的掩码
+        blobs = find_blobs([frame_mask], 100, kernel)  # 腐蚀膨胀后找出面积不小于100的色块
+        blob = max_blob(blobs)  # 面积最大的色块
     
-    for i in lab_data:
-        if i in __target_color:
-            detect_color = i
-            frame_mask = cv2.inRange(frame_lab,
-                                     (lab_data[i]['min'][0],
-                                      lab_data[i]['min'][1],
-                                      lab_data[i]['min'][2]),
-                                     (lab_data[i]['max'][0],
-                                      lab_data[i]['max'][1],
-                                      lab_data[i]['max'][2]))  #对原图像和掩模进行位运算
-            eroded = cv2.erode(frame_mask, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))  #腐蚀
-            dilated = cv2.dilate(eroded, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))) #膨胀
-
-            # 合并所有目标颜色的掩码
-            if frame_mask_combined is None:
-                frame_mask_combined = dilated
-            else:
-                frame_mask_combined = cv2.bitwise_or(frame_mask_combined, dilated)
-    if frame_mask_combined is not None:
-        contours = cv2.findContours(frame_mask_combined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]  # 找出轮廓
-        areaMaxContour, area_max = getAreaMaxContour(contours)  # 找出最大轮廓
+    if blob is None and window is not None:
+        track_misses += 1
+        if track_misses >= TRACK_MAX_MISSES:
+            track_target = None  # 下一帧恢复全图查找
         
-    if areaMaxContour is not None and area_max > 100:  # 有找到最大面积
-        rect = cv2.minAreaRect(areaMaxContour)#最小外接矩形
-        box = np.int0(cv2.boxPoints(rect))#最小外接矩形的四个顶点
-        for j in range(4):
-            box[j, 0] = int(Misc.map(box[j, 0], 0, size[0], 0, img_w))
-            box[j, 1] = int(Misc.map(box[j, 1], 0, size[1], 0, img_h))
-
-        cv2.drawContours(img, [box], -1, (0,255,255), 2)#画出四个点组成的矩形
-        #获取矩形的对角点
-        ptime_start_x, ptime_start_y = box[0, 0], box[0, 1]
-        pt3_x, pt3_y = box[2, 0], box[2, 1]
+    if blob is not None:  # 有找到最大面积
+        #外接矩形的对角点
+        ptime_start_x = int(Misc.map(blob['x'] + x0, 0, size[0], 0, img_w))
+        ptime_start_y = int(Misc.map(blob['y'] + y0, 0, size[1], 0, img_h))
+        pt3_x = int(Misc.map(blob['x'] + blob['w'] + x0, 0, size[0], 0, img_w))
+        pt3_y = int(Misc.map(blob['y'] + blob['h'] + y0, 0, size[1], 0, img_h))
+        if annotate:
+            cv2.rectangle(out, (ptime_start_x, ptime_start_y), (pt3_x, pt3_y), (0,255,255), 2)#画出外接矩形
         radius = abs(ptime_start_x - pt3_x)
         centerX, centerY = int((ptime_start_x + pt3_x) / 2), int((ptime_start_y + pt3_y) / 2)#中心点       
-        cv2.circle(img, (centerX, centerY), 5, (0, 255, 255), -1)#画出中心点
+        if window is not None and ((blob['x'] == 0 and x0 > 0) or (blob['y'] == 0 and y0 > 0)
+                                   or (blob['x'] + blob['w'] == x1 - x0 and x1 < size[0])
+                                   or (blob['y'] + blob['h'] == y1 - y0 and y1 < size[1])):
+            track_target = None  # 色块被搜索窗口截断，大小不准确，下一帧全图查找
+        else:
+            track_target = (centerX, centerY)
+            track_misses = 0
+        if annotate:
+            cv2.circle(out, (centerX, centerY), 5, (0, 255, 255), -1)#画出中心点
           
-        use_time = 0       
-        
-        radius_data.append(radius)
-        data = pd.DataFrame(radius_data)
-        data_ = data.copy()
-        u = data_.mean()  # 计算均值
-        std = data_.std()  # 计算标准差
-
-        data_c = data[np.abs(data - u) <= std]
-        circle_radius = round(data_c.mean()[0], 1)
-        if len(radius_data) == 5:
-            radius_data.remove(radius_data[0])
+        circle_radius = round(radius_filter.update(radius), 1)
             
         #print(circle_radius)
-        x_pid.SetPoint = img_w/2 #设定           
-        x_pid.update(centerX) #当前
-        dx = int(x_pid.output)
-        use_time = abs(dx*0.00025)
-        x_dis += dx #输出           
-        
-        x_dis = servo_data['servo2'] - 400 if x_dis < servo_data['servo2'] - 400 else x_dis          
-        x_dis = servo_data['servo2'] + 400 if x_dis > servo_data['servo2'] + 400 else x_dis
-            
-        y_pid.SetPoint = img_h/2
-        y_pid.update(centerY)
-        dy = int(y_pid.output)
-        use_time = round(max(use_time, abs(dy*0.00025)), 5)
-        y_dis += dy
-        
-        y_dis = servo_data['servo1'] if y_dis < servo_data['servo1'] else y_dis
-        y_dis = 2000 if y_dis > 2000 else y_dis    
-        
-        Board.setPWMServoPulse(1, y_dis, use_time*1000)
-        Board.setPWMServoPulse(2, x_dis, use_time*1000)
-        time.sleep(use_time)
+        # 云台由head_track线程按预测的位置转动，这里只更新测量值
+        predictor.update((centerX, centerY, circle_radius), time.monotonic() if stamp is None else stamp)
+        head_event.set()
     else:
         centerX, centerY = -1, -1
-   
-    #img = cv2.remap(img, mapx, mapy, cv2.INTER_LINEAR)  # 畸变矫正 
 
-    return img
+    move()
+
+    return out
 
 if __name__ == '__main__':
     init()
     start()
     __target_color = ('red','green','blue')
-    open_once = yaml_handle.get_yaml_data('/boot/camera_setting.yaml')['open_once']
-    if open_once:
-        my_camera = cv2.VideoCapture('http://127.0.0.1:8080/?action=stream?dummy=param.mjpg')
-    else:
-        my_camera = Camera.Camera()
-        my_camera.camera_open() 
-    AGC.runActionGroup('stand')
+    show_frame = True  # 没有显示器时设为False，不画标记也不显示画面
+    my_camera = open_camera()  # 取帧线程，总是取得最新的一帧
+    ActionPlayer.runActionGroup('stand')
+    seq = 0
     while True:
-        ret, img = my_camera.read()
+        # img为取帧线程的缓冲区，在下一次取帧前不会被改写，不需要复制
+        seq, stamp, img = my_camera.latest(seq)
         if img is not None:
-            frame = img.copy()
-            Frame = run(frame)           
-            cv2.imshow('Frame', Frame)
-            key = cv2.waitKey(1)
-            if key == 27:
-                break
-        else:
-            time.sleep(0.01)
+            Frame = run(img, annotate=show_frame, stamp=stamp)           
+            if show_frame:
+                cv2.imshow('Frame', Frame)
+                key = cv2.waitKey(1)
+                if key == 27:
+                    break
     my_camera.camera_close()
     cv2.destroyAllWindows()
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# coding=utf8
+# 颜色查找表：根据lab_data中各颜色的LAB阈值，预先计算量化后的BGR颜色属于哪些颜色，
+# 每帧只需一次查表得到标签图，不再每种颜色各做一次BGR转LAB和inRange
+import cv2
+import numpy as np
+
+LUT_BITS = 6  # 每个通道量化后的位数
+
+class ColorLUT:
+    """
+    BGR -> 颜色标签的查找表
+
+    标签图中每个像素的第k位为1表示该像素属于names[k]，一个像素可以同时属于多种颜色。
+    BGR每个通道只保留高bits位，按量化区间的中心计算LAB值，
+    因此阈值边界附近的颜色与cv2.inRange的结果可能相差一个量化区间
+
+    Args:
+        bits: 每个通道量化后的位数
+    """
+    def __init__(self, bits=LUT_BITS):
+        self.bits = bits
+        self.names = []
+        self.table = None
+        self.key = None
+        # 每个通道量化后移到各自的位置，三个通道按位或即为查找表的下标：
+        # B | G << bits | R << 2*bits，查找表没有空位，6位时为256KB
+        self.channel_lut = np.zeros((1, 256, 3), dtype=np.int32)
+        values = np.arange(256, dtype=np.int32) >> (8 - bits)
+        self.channel_lut[0, :, 0] = values
+        self.channel_lut[0, :, 1] = values << bits
+        self.channel_lut[0, :, 2] = values << (2 * bits)
+        self.quantized = None
+        self.index = None
+
+    def build(self, lab_data, names=None):
+        """
+        根据阈值生成查找表，阈值没有变化时不重新生成
+
+        Args:
+            lab_data: 颜色名称 -> {'min': [L, A, B], 'max': [L, A, B]}
+            names: 需要识别的颜色，默认为lab_data中的全部颜色
+
+        Returns:
+            是否重新生成了查找表
+        """
+        if names is None:
+            names = list(lab_data)
+        ranges = [(name, tuple(lab_data[name]['min']), tuple(lab_data[name]['max'])) for name in names]
+        if ranges == self.key:
+            return False
+
+        n = 1 << self.bits
+        shift = 8 - self.bits
+        centers = (np.arange(n, dtype=np.uint32) << shift) + ((1 << shift) >> 1)
+        b, g, r = np.meshgrid(centers, centers, centers, indexing='ij')
+        grid = np.stack((b, g, r), axis=-1).astype(np.uint8).reshape(-1, 1, 3)
+        lab = cv2.cvtColor(grid, cv2.COLOR_BGR2LAB).reshape(-1, 3)
+
+        dtype = np.uint8 if len(names) <= 8 else (np.uint16 if len(names) <= 16 else np.uint32)
+        labels = np.zeros(len(lab), dtype=dtype)
+        for k, (name, low, high) in enumerate(ranges):
+            inside = np.all((lab >= low) & (lab <= high), axis=1)
+            labels[inside] |= dtype(1 << k)
+        # 按classify中的下标排列
+        bits = self.bits
+        index = (r.reshape(-1) >> shift) << (2 * bits) | (g.reshape(-1) >> shift) << bits | (b.reshape(-1) >> shift)
+        table = np.zeros(1 << (3 * bits), dtype=dtype)
+        table[index] = labels
+
+        self.table = table
+        self.names = list(names)
+        self.key = ranges
+        return True
+
+    def bit(self, names):
+        """颜色名称(或名称列表)对应的标签位，不在查找表中的颜色忽略"""
+        if isinstance(names, str):
+            names = (names,)
+        bits = 0
+        for name in names:
+            if name in self.names:
+                bits |= 1 << self.names.index(name)
+        return bits
+
+    def classify(self, img):
+        """
+        查表得到标签图
+
+        Args:
+            img: BGR图像
+
+        Returns:
+            标签图，形状为图像的高和宽
+        """
+        h, w = img.shape[:2]
+        if self.quantized is None or self.quantized.shape[0] < h or self.quantized.shape[1] < w:
+            self.quantized = np.empty((h, w, 3), dtype=np.int32)
+            self.index = np.empty((h, w), dtype=np.int32)
+        # 图像比缓冲区小时(如只处理搜索窗口)使用缓冲区的左上角，不重新分配
+        quantized = cv2.LUT(img, self.channel_lut, dst=self.quantized[:h, :w])
+        index = np.bitwise_or(quantized[:, :, 0], quantized[:, :, 1], out=self.index[:h, :w])
+        np.bitwise_or(index, quantized[:, :, 2], out=index)
+        return self.table[index]
+
+    def mask(self, labels, names):
+        """
+        标签图中属于names中任一颜色的像素
+
+        Returns:
+            uint8掩码，属于为255，与cv2.inRange的输出相同
+        """
+        selected = np.bitwise_and(labels, labels.dtype.type(self.bit(names)))
+        if selected.dtype == np.uint32:
+            return (selected != 0).astype(np.uint8) * 255
+        return cv2.compare(selected, 0, cv2.CMP_GT)
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# coding=utf8
+# 颜色投票：最近几帧中每帧面积最大的色块按面积加权投票，各颜色的票数随新帧加入、旧帧移出增量更新，
+# 某种颜色的票数超过上阈值时立即确定，降到下阈值以下才取消，不再把颜色编号取平均
+VOTE_WINDOW = 8      # 参与投票的最近帧数
+VOTE_ON = 2.5        # 票数达到该值时确定颜色
+VOTE_OFF = 1.0       # 已确定的颜色票数低于该值时取消
+# 色块面积(处理图像的像素)达到该值时为一整票，小于该值时按比例。检测时面积超过200的色块才有效，
+# 该值不能超过 VOTE_WINDOW*200/VOTE_ON，保证刚超过200的色块连续出现时也能确定颜色
+FULL_AREA = 600
+
+class ColorVote:
+    """
+    滑动窗口的颜色投票
+
+    Args:
+        names: 参与投票的颜色，其他颜色视为没有找到
+        window: 参与投票的最近帧数
+        on: 票数达到该值时确定颜色
+        off: 已确定的颜色票数低于该值时取消
+        full_area: 色块面积达到该值时为一整票
+    """
+    def __init__(self, names, window=VOTE_WINDOW, on=VOTE_ON, off=VOTE_OFF, full_area=FULL_AREA):
+        self.names = list(names)
+        self.window = window
+        self.on = on
+        self.off = off
+        self.full_area = float(full_area)
+        self.reset()
+
+    def reset(self):
+        self.votes = [None] * self.window   # 每帧投给的颜色
+        self.weights = [0.0] * self.window  # 每帧的票数
+        self.scores = dict.fromkeys(self.names, 0.0)
+        self.index = 0
+        self.current = None  # 已确定的颜色
+
+    def update(self, name, area=0):
+        """
+        加入一帧的结果
+
+        Args:
+            name: 面积最大的色块的颜色，没有找到时为None
+            area: 色块面积
+
+        Returns:
+            新确定的颜色，没有新确定的颜色时返回None
+        """
+        old = self.votes[self.index]
+        if old is not None:
+            self.scores[old] = max(0.0, self.scores[old] - self.weights[self.index])
+        if name in self.scores:
+            weight = min(area / self.full_area, 1.0)
+            self.scores[name] += weight
+        else:
+            name, weight = None, 0.0
+        self.votes[self.index] = name
+        self.weights[self.index] = weight
+        self.index = (self.index + 1) % self.window
+
+        if self.current is not None and self.scores[self.current] < self.off:
+            self.current = None
+        best = max(self.names, key=self.scores.get)
+        if best != self.current and self.scores[best] >= self.on and \
+                (self.current is None or self.scores[best] > self.scores[self.current]):
+            self.current = best
+            return best
+        return None
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+# coding=utf8
+# 取帧线程：在单独的线程中把相机画面写入几块预先分配的缓冲区，处理线程总是拿到最新的一帧，
+# 处理不过来时丢弃旧帧并计数，不会排队处理过时的画面，每帧也不需要再分配和复制整幅图像
+import time
+import threading
+import cv2
+import numpy as np
+import hiwonder.Camera as Camera
+import hiwonder.yaml_handle as yaml_handle
+
+STREAM_URL = 'http://127.0.0.1:8080/?action=stream?dummy=param.mjpg'
+CAMERA_SETTING = '/boot/camera_setting.yaml'
+FRAME_SIZE = (640, 480)  # 缓冲区的图像大小(宽, 高)
+BUFFER_NUM = 3           # 最新帧、处理线程正在使用的帧、正在写入的帧各一块
+
+class FrameGrabber:
+    """
+    相机取帧线程
+
+    source可以是cv2.VideoCapture(mjpg视频流)或hiwonder的Camera.Camera。
+    VideoCapture直接解码到缓冲区中；Camera.Camera自己有取帧线程，
+    这里只在它的画面更新时复制一次到缓冲区
+
+    latest()返回的图像就是缓冲区本身，在下一次调用latest()或read()之前不会被改写，
+    处理线程可以直接在上面画图，不需要再复制
+
+    Args:
+        source: 相机
+        size: 缓冲区的图像大小(宽, 高)，画面大小不同时缩放到该大小
+        buffer_num: 缓冲区数量，至少为3
+    """
+    def __init__(self, source, size=FRAME_SIZE, buffer_num=BUFFER_NUM):
+        self.source = source
+        self.size = size
+        self.buffers = [np.empty((size[1], size[0], 3), dtype=np.uint8) for _ in range(max(3, buffer_num))]
+        self.cond = threading.Condition()
+        self.latest_index = -1  # 最新一帧所在的缓冲区
+        self.reading_index = -1 # 处理线程正在使用的缓冲区
+        self.consumed = True    # 最新一帧是否已被取走
+        self.seq = 0            # 最新一帧的序号，从1开始
+        self.stamp = 0.0        # 最新一帧的采集时间(time.monotonic())
+        self.grabbed = 0        # 采集到的帧数
+        self.dropped = 0        # 没有被取走就被新帧替换的帧数
+        self.running = True
+        self.thread = threading.Thread(target=self.worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def grab_capture(self, buf):
+        """从VideoCapture取一帧写入buf，返回采集时间，失败时返回None"""
+        if not self.source.grab():
+            return None
+        stamp = time.monotonic()
+        ret, frame = self.source.retrieve(buf)
+        if not ret or frame is None:
+            return None
+        if frame is not buf:
+            # 视频流的分辨率与缓冲区不同
+            cv2.resize(frame, self.size, dst=buf, interpolation=cv2.INTER_NEAREST)
+        return stamp
+
+    def grab_camera(self, buf):
+        """从Camera.Camera取一帧写入buf，画面没有更新时返回None"""
+        # Camera.Camera的取帧线程每次把新画面赋值给frame，按对象判断画面是否更新
+        frame = getattr(self.source, 'frame', None)
+        if frame is None:
+            ret, frame = self.source.read()
+        if frame is None or frame is self.last_frame:
+            return None
+        self.last_frame = frame
+        stamp = time.monotonic()
+        if frame.shape[:2] == buf.shape[:2]:
+            np.copyto(buf, frame)
+        else:
+            cv2.resize(frame, self.size, dst=buf, interpolation=cv2.INTER_NEAREST)
+        return stamp
+
+    def worker(self):
+        self.last_frame = None
+        grab = self.grab_capture if isinstance(self.source, cv2.VideoCapture) else self.grab_camera
+        while self.running:
+            with self.cond:
+                # 写入一块既不是最新帧也没有被处理线程使用的缓冲区
+                index = next(i for i in range(len(self.buffers))
+                             if i != self.latest_index and i != self.reading_index)
+            try:
+                stamp = grab(self.buffers[index])
+            except Exception as e:
+                print('取帧出错: %s' % e)
+                stamp = None
+            if stamp is None:
+                time.sleep(0.005)
+                continue
+            with self.cond:
+                if not self.consumed:
+                    self.dropped += 1
+                self.latest_index = index
+                self.consumed = False
+                self.seq += 1
+                self.stamp = stamp
+                self.grabbed += 1
+                self.cond.notify_all()
+
+    def latest(self, last_seq=0, timeout=1.0):
+        """
+        等待并取得序号大于last_seq的最新一帧
+
+        Args:
+            last_seq: 上一次取得的帧序号
+            timeout: 等待的最长时间(秒)，为None时一直等待
+
+        Returns:
+            (序号, 采集时间, 图像)，超时时图像为None
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > last_seq or not self.running, timeout) \
+                    or self.seq <= last_seq:
+                return self.seq, self.stamp, None
+            self.reading_index = self.latest_index
+            self.consumed = True
+            return self.seq, self.stamp, self.buffers[self.reading_index]
+
+    def read(self):
+        """与Camera.read()相同的接口，返回(ret, 图像)"""
+        with self.cond:
+            last_seq = self.seq - 1 if not self.consumed else self.seq
+        seq, stamp, frame = self.latest(last_seq)
+        return frame is not None, frame
+
+    def close(self):
+        """停止取帧线程并关闭相机"""
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        self.thread.join(1.0)
+        if isinstance(self.source, cv2.VideoCapture):
+            self.source.release()
+        else:
+            self.source.camera_close()
+
+    # 与Camera.Camera相同的接口
+    camera_close = close
+
+def open_camera(size=FRAME_SIZE, buffer_num=BUFFER_NUM):
+    """
+    按/boot/camera_setting.yaml打开相机并启动取帧线程：
+    open_once为True时从mjpg视频流取帧，否则直接打开相机
+    """
+    open_once = yaml_handle.get_yaml_data(CAMERA_SETTING)['open_once']
+    if open_once:
+        source = cv2.VideoCapture(STREAM_URL)
+    else:
+        source = Camera.Camera()
+        source.camera_open()
+    return FrameGrabber(source, size, buffer_num)
+
+if __name__ == '__main__':
+    camera = open_camera()
+    seq = 0
+    while True:
+        seq, stamp, img = camera.latest(seq)
+        if img is None:
+            continue
+        cv2.putText(img, 'seq: %d  dropped: %d  delay: %.1fms' % (seq, camera.dropped, (time.monotonic() - stamp) * 1000),
+                    (10, img.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+        cv2.imshow('Frame', img)
+        key = cv2.waitKey(1)
+        if key == 27:
+            break
+    camera.close()
+    cv2.destroyAllWindows()
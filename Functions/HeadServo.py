@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# coding=utf8
+# 云台舵机指令合并：只保留最新的目标位置，变化小于死区的指令不发送，限制每秒发送的指令数，
+# 上一次转动没有完成时不发送，两个舵机用一条指令发送，减少与步态动作争用总线
+import time
+import threading
+import hiwonder.Board as Board
+
+DEADBAND = 5     # 两个舵机的脉宽变化都小于该值时不发送
+MAX_RATE = 20.0  # 每秒最多发送的指令数
+
+class HeadServo:
+    """
+    云台舵机(1号和2号PWM舵机)
+
+    move()只更新目标位置，立即返回；发送线程在允许发送时发送最新的目标位置，
+    期间的多次move()合并为一条指令
+
+    Args:
+        deadband: 两个舵机的脉宽变化都小于该值时不发送
+        max_rate: 每秒最多发送的指令数
+    """
+    def __init__(self, deadband=DEADBAND, max_rate=MAX_RATE):
+        self.deadband = deadband
+        self.min_interval = 1.0 / max_rate
+        self.cond = threading.Condition()
+        self.pending = None    # 等待发送的(1号脉宽, 2号脉宽, 时间)
+        self.last = None       # 最后发送的(1号脉宽, 2号脉宽)
+        self.next_time = 0.0   # 允许发送下一条指令的时间
+        self.sent = 0          # 发送的指令数
+        self.merged = 0        # 发送前被新的目标位置替换的指令数
+        self.suppressed = 0    # 在死区内没有发送的指令数
+        self.thread = threading.Thread(target=self.worker)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def move(self, pulse1, pulse2, use_time):
+        """
+        设置云台的目标位置
+
+        Args:
+            pulse1: 1号舵机(上下)的脉宽
+            pulse2: 2号舵机(左右)的脉宽
+            use_time: 转动时间(毫秒)
+
+        Returns:
+            是否需要发送，在死区内时返回False
+        """
+        pulse1 = int(pulse1)
+        pulse2 = int(pulse2)
+        with self.cond:
+            last = self.last
+            if last is not None and abs(pulse1 - last[0]) < self.deadband and abs(pulse2 - last[1]) < self.deadband:
+                # 已经在目标位置附近，还没发送的指令也不需要了
+                self.suppressed += 1
+                if self.pending is not None:
+                    self.merged += 1
+                    self.pending = None
+                return False
+            if self.pending is not None:
+                self.merged += 1
+            self.pending = (pulse1, pulse2, int(use_time))
+            self.cond.notify()
+        return True
+
+    def stats(self):
+        """发送、合并和忽略的指令数"""
+        with self.cond:
+            return {'sent': self.sent, 'merged': self.merged, 'suppressed': self.suppressed}
+
+    def send(self, pulse1, pulse2, use_time):
+        set_pulses = getattr(Board, 'setPWMServosPulse', None)
+        if set_pulses is not None:
+            # 参数为: 时间, 舵机个数, id1, 脉宽1, id2, 脉宽2
+            set_pulses([use_time, 2, 1, pulse1, 2, pulse2])
+        else:
+            Board.setPWMServoPulse(1, pulse1, use_time)
+            Board.setPWMServoPulse(2, pulse2, use_time)
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                wait = self.next_time - time.monotonic()
+                if wait > 0:
+                    # 等待期间收到的新目标位置替换pending
+                    self.cond.wait(wait)
+                    continue
+                pulse1, pulse2, use_time = self.pending
+                self.pending = None
+                self.last = (pulse1, pulse2)
+                # 上一次转动完成且不超过最大频率时才能发送下一条
+                self.next_time = time.monotonic() + max(self.min_interval, use_time / 1000.0)
+                self.sent += 1
+            try:
+                self.send(pulse1, pulse2, use_time)
+            except Exception as e:
+                print('云台舵机指令发送失败: %s' % e)
@@ -18,9 +18,107 @@ import hiwonder.Camera as Camera
 import hiwonder.ActionGroupControl as AGC
 import hiwonder.yaml_handle as yaml_handle
 from CameraCalibration.CalibrationConfig import *
+from Functions.Undistort import Undistorter, load_maps
+from Functions.FrameGrabber import FrameGrabber, FRAME_SIZE
+
+# MobileNet SSD的输入大小
+SSD_SIZE = (300, 300)
+
+DEFAULT_THRESHOLD = 0.3  # 默认的置信度阈值
+NMS_THRESHOLD = 0.45     # 同一类别的检测框交并比超过该值时只保留置信度最高的
+
+# 检测结果：类别编号、置信度和检测框(左上角x, y, 宽, 高)，按置信度从高到低排列
+DETECTION_DTYPE = np.dtype([
+    ('class_id', np.int32),
+    ('confidence', np.float32),
+    ('x', np.int32),
+    ('y', np.int32),
+    ('w', np.int32),
+    ('h', np.int32),
+])
+
+DETECT_RATE = 2.0        # 连续识别模式下每秒识别的次数
+HALF_LIFE = 2.0          # 连续识别模式下识别结果的权重减半的时间(秒)
+ANSWER_THRESHOLD = 0.15  # 最近各帧的平均置信度达到该值的类别才回答
+MAX_AGE = 2.0            # 最近一次识别超过该时间(秒)时不使用统计结果，重新识别
+
+class DetectionAggregate:
+    """
+    最近识别结果的时间衰减统计
+
+    每个类别的得分为最近各帧中该类别最高置信度的加权平均(没有检测到的帧为0)，
+    权重随时间指数衰减，只在一两帧中出现的误检得分很低
+
+    Args:
+        class_num: 类别数
+        half_life: 权重减半的时间(秒)
+        threshold: 得分达到该值的类别才出现在结果中
+        max_age: 最近一次识别超过该时间(秒)时没有结果
+    """
+    def __init__(self, class_num, half_life=HALF_LIFE, threshold=ANSWER_THRESHOLD, max_age=MAX_AGE):
+        self.class_num = class_num
+        self.half_life = half_life
+        self.threshold = threshold
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.scores = np.zeros(self.class_num)  # 衰减后的置信度之和
+            self.total = 0.0                        # 衰减后的帧数
+            self.boxes = np.zeros(self.class_num, dtype=DETECTION_DTYPE)  # 各类别最近一次的检测结果
+            self.stamp = None                       # 最近一次识别的画面采集时间
+
+    def update(self, detections, stamp):
+        """
+        加入一帧的识别结果
+
+        Args:
+            detections: DETECTION_DTYPE数组，按置信度从高到低排列
+            stamp: 画面的采集时间(time.monotonic())
+        """
+        detections = detections[(detections['class_id'] >= 0) & (detections['class_id'] < self.class_num)]
+        # 每个类别只取置信度最高的一个
+        class_ids, first = np.unique(detections['class_id'], return_index=True)
+        with self.lock:
+            decay = 0.0 if self.stamp is None else 0.5 ** (max(stamp - self.stamp, 0.0) / self.half_life)
+            self.scores *= decay
+            self.scores[class_ids] += detections['confidence'][first]
+            self.total = self.total * decay + 1.0
+            self.boxes[class_ids] = detections[first]
+            self.stamp = stamp
+
+    def result(self, stamp):
+        """
+        stamp时刻的统计结果
+
+        Returns:
+            DETECTION_DTYPE数组，置信度为得分，检测框为最近一次检测到的位置，按得分从高到低排列；
+            没有识别过或最近一次识别已超过max_age时返回None
+        """
+        with self.lock:
+            if self.stamp is None or stamp - self.stamp > self.max_age:
+                return None
+            average = self.scores / self.total
+            class_ids = np.flatnonzero(average >= self.threshold)
+            results = self.boxes[class_ids]
+            results['confidence'] = average[class_ids]
+        return results[np.argsort(-results['confidence'], kind='stable')]
 
 class ObjectDetection:
-    def __init__(self):
+    def __init__(self, use_undistort=True, annotate=True, class_thresholds=None, continuous=False,
+                 detect_rate=DETECT_RATE):
+        # use_undistort为True时，畸变矫正和缩放到模型输入大小用一次remap完成，不再矫正整帧
+        self.use_undistort = use_undistort
+        # continuous为True时在后台线程中按detect_rate不断识别，收到语音指令时直接用最近的统计结果回答
+        self.continuous = continuous
+        self.detect_rate = detect_rate
+        # 各类别的置信度阈值，英文类别名称 -> 阈值，例如{'person': 0.5, 'bottle': 0.25}，
+        # 没有列出的类别使用DEFAULT_THRESHOLD
+        self.class_thresholds = class_thresholds or {}
+        # annotate为False时不画检测结果，也不打开显示窗口，没有显示器时使用
+        self.annotate = annotate
         # 加载舵机参数
         self.servo_data = yaml_handle.get_yaml_data(yaml_handle.servo_file_path)
         
@@ -51,23 +149,37 @@ class ObjectDetection:
             print(f"详细错误: {traceback.format_exc()}")
             self.asr_tts_ok = False
         
-        # 初始化相机
-        self.camera = Camera.Camera()
-        self.camera.camera_open()
+        # 初始化相机，取帧线程中不断更新最新的一帧，检测时直接取用
+        camera = Camera.Camera()
+        camera.camera_open()
+        self.camera = FrameGrabber(camera)
         
-        # 加载相机校准参数
-        param_data = np.load(calibration_param_path + '.npz')
-        self.mtx = param_data['mtx_array']
-        self.dist = param_data['dist_array']
-        self.newcameramtx, self.roi = cv2.getOptimalNewCameraMatrix(self.mtx, self.dist, (640, 480), 0, (640, 480))
-        self.mapx, self.mapy = cv2.initUndistortRectifyMap(self.mtx, self.dist, None, self.newcameramtx, (640, 480), 5)
+        # 加载相机校准参数，映射表按标定参数的哈希值缓存，标定参数不变时直接读取
+        if self.use_undistort:
+            self.undistorter = Undistorter(calibration_param_path, SSD_SIZE)
+            # 检测框为矫正后画面中的坐标，需要显示和保存结果时也矫正整帧，检测框画在矫正后的画面上
+            self.display_undistorter = Undistorter(calibration_param_path, FRAME_SIZE) if self.annotate else None
+        else:
+            self.undistorter = None
+            self.mapx, self.mapy = load_maps(calibration_param_path, (640, 480), m1type=cv2.CV_32FC1)
+        
+        # 每次检测重复使用的缓冲区：模型输入、矫正后的画面，以及两块轮流使用的结果图像，
+        # 显示线程读取上一块时不会被改写
+        self.input_frame = np.empty((SSD_SIZE[1], SSD_SIZE[0], 3), dtype=np.uint8)
+        self.undistorted = np.empty((FRAME_SIZE[1], FRAME_SIZE[0], 3), dtype=np.uint8)
+        self.overlays = [np.empty((FRAME_SIZE[1], FRAME_SIZE[0], 3), dtype=np.uint8) for _ in range(2)]
+        self.overlay_index = 0
         
         # 使用MobileNet SSD模型
         self.classes, self.english_classes, self.net = self.load_model()
+        self.thresholds = self.build_thresholds(self.class_thresholds)
+        self.aggregate = DetectionAggregate(len(self.thresholds))
+        self.detect_lock = threading.Lock()  # 后台识别和手动识别共用缓冲区，不能同时进行
         
         # 创建窗口显示结果
-        cv2.namedWindow('Detection Result', cv2.WINDOW_NORMAL)
-        cv2.resizeWindow('Detection Result', 640, 480)
+        if self.annotate:
+            cv2.namedWindow('Detection Result', cv2.WINDOW_NORMAL)
+            cv2.resizeWindow('Detection Result', 640, 480)
         
         # 保存最后的检测结果
         self.last_result = None
@@ -119,7 +231,7 @@ class ObjectDetection:
                 # 使用OpenCV内置的人脸检测器作为备用
                 net = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
                 print("已加载备用人脸检测器")
-                return {"face": "人脸"}, {"face": "Face"}, net
+                return {0: "人脸"}, {0: "Face"}, net
             except Exception as e:
                 print(f"加载备用检测器失败: {e}")
                 print(f"详细错误: {traceback.format_exc()}")
@@ -136,9 +248,83 @@ class ObjectDetection:
                 print(f"详细错误: {traceback.format_exc()}")
                 return chinese_classes, english_classes, None
     
-    def detect_objects(self, frame):
+    def build_thresholds(self, class_thresholds):
+        """按类别编号排列的置信度阈值，背景类的阈值大于1，不会被检测出"""
+        thresholds = np.full(max(self.english_classes) + 1, DEFAULT_THRESHOLD, dtype=np.float32)
+        for class_id, name in self.english_classes.items():
+            if name == "background":
+                thresholds[class_id] = 2.0
+            elif name in class_thresholds:
+                thresholds[class_id] = class_thresholds[name]
+        return thresholds
+    
+    def class_name(self, obj):
+        """检测结果的中文类别名称"""
+        return self.classes.get(int(obj['class_id']), "未知物体")
+    
+    def class_name_en(self, obj):
+        """检测结果的英文类别名称"""
+        return self.english_classes.get(int(obj['class_id']), "Unknown")
+    
+    def decode_detections(self, detections, w, h):
+        """
+        把SSD的输出转换为检测结果，全部用NumPy批量计算：
+        按各类别的阈值筛选，检测框缩放到图像大小并限制在图像范围内，再按类别做非极大值抑制
+        
+        Args:
+            detections: net.forward()的输出，形状为(1, 1, N, 7)
+            w, h: 图像的宽和高
+        
+        Returns:
+            DETECTION_DTYPE数组，按置信度从高到低排列
+        """
+        detections = detections.reshape(-1, 7)
+        class_ids = detections[:, 1].astype(np.int32)
+        confidences = detections[:, 2]
+        known = (class_ids >= 0) & (class_ids < len(self.thresholds))
+        keep = known & (confidences > self.thresholds[np.where(known, class_ids, 0)])
+        detections = detections[keep]
+        
+        # 检测框缩放到图像大小，左上角不小于0，右下角不超过图像大小
+        boxes = (detections[:, 3:7] * np.array([w, h, w, h], dtype=np.float32)).astype(np.int32)
+        np.maximum(boxes[:, :2], 0, out=boxes[:, :2])
+        np.minimum(boxes[:, 2:], (w, h), out=boxes[:, 2:])
+        
+        results = np.empty(len(detections), dtype=DETECTION_DTYPE)
+        results['class_id'] = class_ids[keep]
+        results['confidence'] = confidences[keep]
+        results['x'] = boxes[:, 0]
+        results['y'] = boxes[:, 1]
+        results['w'] = boxes[:, 2] - boxes[:, 0]
+        results['h'] = boxes[:, 3] - boxes[:, 1]
+        
+        # 同一类别的重叠检测框只保留置信度最高的
+        if len(results) > 1:
+            rects = np.stack((results['x'], results['y'], results['w'], results['h']), axis=1).tolist()
+            scores = results['confidence'].tolist()
+            if hasattr(cv2.dnn, 'NMSBoxesBatched'):
+                # OpenCV 4.7以上，按类别分组的NMS一次完成
+                picked = cv2.dnn.NMSBoxesBatched(rects, scores, results['class_id'].tolist(), 0.0, NMS_THRESHOLD)
+                picked = np.array(picked, dtype=np.int64).reshape(-1)
+            else:
+                picked = []
+                for class_id in np.unique(results['class_id']):
+                    index = np.flatnonzero(results['class_id'] == class_id)
+                    nms = cv2.dnn.NMSBoxes([rects[i] for i in index], [scores[i] for i in index], 0.0, NMS_THRESHOLD)
+                    picked.append(index[np.array(nms, dtype=np.int64).reshape(-1)])
+                picked = np.concatenate(picked)
+            results = results[picked]
+        return results[np.argsort(-results['confidence'], kind='stable')]
+    
+    def detect_objects(self, frame, input_frame=None):
+        """
+        frame: 用于计算检测框坐标的图像
+        input_frame: 已经矫正并缩放到SSD_SIZE的模型输入，为None时由frame缩放得到
+        
+        返回DETECTION_DTYPE数组，按置信度从高到低排列
+        """
         if self.net is None:
-            return []
+            return np.empty(0, dtype=DETECTION_DTYPE)
             
         # 检查是级联分类器还是深度学习模型
         if isinstance(self.net, cv2.CascadeClassifier):
@@ -146,66 +332,45 @@ class ObjectDetection:
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             faces = self.net.detectMultiScale(gray, 1.3, 5)
             
-            results = []
-            for (x, y, w, h) in faces:
-                results.append({
-                    'class': "人脸",
-                    'class_en': "Face",
-                    'confidence': 0.9,  # 固定置信度
-                    'box': [x, y, w, h]
-                })
+            results = np.zeros(len(faces), dtype=DETECTION_DTYPE)  # 类别编号为0(人脸)
+            results['confidence'] = 0.9  # 固定置信度
+            if len(faces):
+                faces = np.asarray(faces)
+                results['x'], results['y'], results['w'], results['h'] = faces[:, 0], faces[:, 1], faces[:, 2], faces[:, 3]
             return results
         else:
             # 使用MobileNet SSD
             try:
                 # 预处理图像 - 使用更小的尺寸加快速度
                 (h, w) = frame.shape[:2]
-                blob = cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)), 0.007843, (300, 300), 127.5)
+                if input_frame is None:
+                    input_frame = cv2.resize(frame, SSD_SIZE, dst=self.input_frame)
+                blob = cv2.dnn.blobFromImage(input_frame, 0.007843, SSD_SIZE, 127.5)
                 
                 # 前向传播
                 self.net.setInput(blob)
                 detections = self.net.forward()
                 
                 # 处理检测结果
-                results = []
-                for i in range(detections.shape[2]):
-                    confidence = detections[0, 0, i, 2]
-                    
-                    # 过滤掉低置信度的检测结果，降低阈值以检测更多物体
-                    if confidence > 0.3:
-                        idx = int(detections[0, 0, i, 1])
-                        box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                        (startX, startY, endX, endY) = box.astype("int")
-                        
-                        # 确保边界框在图像范围内
-                        startX = max(0, startX)
-                        startY = max(0, startY)
-                        endX = min(w, endX)
-                        endY = min(h, endY)
-                        
-                        # 添加到结果列表，同时保存中文和英文类别
-                        results.append({
-                            'class': self.classes.get(idx, "未知物体"),
-                            'class_en': self.english_classes.get(idx, "Unknown"),
-                            'confidence': float(confidence),
-                            'box': [startX, startY, endX - startX, endY - startY]
-                        })
-                return results
+                return self.decode_detections(detections, w, h)
             except Exception as e:
                 print(f"检测过程出错: {e}")
                 print(f"详细错误: {traceback.format_exc()}")
-                return []
+                return np.empty(0, dtype=DETECTION_DTYPE)
     
-    def draw_detections(self, frame, detections):
+    def draw_detections(self, frame, detections, out=None):
+        """在out上画出检测结果，out为None时直接画在frame上；不为None时先把frame复制到out"""
+        if out is not None and out is not frame:
+            np.copyto(out, frame)
+            frame = out
         for obj in detections:
-            box = obj['box']
-            x, y, w, h = box
+            x, y, w, h = int(obj['x']), int(obj['y']), int(obj['w']), int(obj['h'])
             
             # 绘制边界框
             cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
             
             # 绘制标签 - 使用英文类别名称
-            label = f"{obj['class_en']}: {obj['confidence']:.2f}"
+            label = f"{self.class_name_en(obj)}: {obj['confidence']:.2f}"
             cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
         
         return frame
@@ -215,7 +380,7 @@ class ObjectDetection:
             # 如果TTS不可用，只在控制台打印结果
             return self.print_results(detections)
             
-        if not detections:
+        if len(detections) == 0:
             try:
                 self.tts.TTSModuleSpeak('', '我没有识别出任何物体')
                 time.sleep(2)  # 给TTS一些播放时间
@@ -225,17 +390,17 @@ class ObjectDetection:
                 self.asr_tts_ok = False
             return
         
-        # 按置信度排序，取前三个最可能的物体
-        top_detections = sorted(detections, key=lambda x: x['confidence'], reverse=True)[:3]
+        # 检测结果已按置信度排序，取前三个最可能的物体
+        top_detections = detections[:3]
         
         try:
             if len(top_detections) == 1:
                 obj = top_detections[0]
-                message = f'这是{obj["class"]}'
+                message = f'这是{self.class_name(obj)}'
                 self.tts.TTSModuleSpeak('', message)
                 print(message)
             else:
-                objects_text = '、'.join([obj['class'] for obj in top_detections])
+                objects_text = '、'.join([self.class_name(obj) for obj in top_detections])
                 message = f'我看到了{objects_text}'
                 self.tts.TTSModuleSpeak('', message)
                 print(message)
@@ -246,22 +411,22 @@ class ObjectDetection:
             self.asr_tts_ok = False
     
     def print_results(self, detections):
-        if not detections:
+        if len(detections) == 0:
             print("未检测到任何物体")
             return
             
-        # 按置信度排序，取前三个最可能的物体
-        top_detections = sorted(detections, key=lambda x: x['confidence'], reverse=True)[:3]
+        # 检测结果已按置信度排序，取前三个最可能的物体
+        top_detections = detections[:3]
         
         if len(top_detections) == 1:
             obj = top_detections[0]
-            print(f"这是{obj['class']}（{obj['class_en']}），置信度: {obj['confidence']:.2f}")
+            print(f"这是{self.class_name(obj)}（{self.class_name_en(obj)}），置信度: {obj['confidence']:.2f}")
         else:
             print("检测结果:")
             for i, obj in enumerate(top_detections):
-                print(f"{i+1}. {obj['class']}（{obj['class_en']}），置信度: {obj['confidence']:.2f}")
+                print(f"{i+1}. {self.class_name(obj)}（{self.class_name_en(obj)}），置信度: {obj['confidence']:.2f}")
             
-            objects_text = '、'.join([obj['class'] for obj in top_detections])
+            objects_text = '、'.join([self.class_name(obj) for obj in top_detections])
             print(f"总结: 我看到了{objects_text}")
     
     def display_thread(self):
@@ -274,31 +439,76 @@ class ObjectDetection:
                     self.exit_flag = True
             time.sleep(0.03)  # 降低刷新频率减轻CPU负担
     
-    def manual_detection(self):
-        """手动触发检测（不依赖语音）"""
-        # 捕获一帧图像
-        ret, frame = self.camera.read()
-        if not ret:
-            print("无法获取图像")
-            return
-        
+    def detect_frame(self, frame):
+        """矫正画面并检测物体，返回(矫正后的画面, 检测结果)"""
         # 图像校正
-        frame = cv2.remap(frame, self.mapx, self.mapy, cv2.INTER_LINEAR)
+        if self.undistorter is not None:
+            input_frame = self.undistorter.remap(frame, self.input_frame)  # 矫正并缩放到模型输入大小
+            if self.display_undistorter is not None:
+                frame = self.display_undistorter.remap(frame, self.undistorted)  # 用于显示和保存的矫正画面
+        else:
+            frame = cv2.remap(frame, self.mapx, self.mapy, cv2.INTER_LINEAR, dst=self.undistorted)
+            input_frame = None
         
-        # 检测物体
-        detections = self.detect_objects(frame)
+        # 检测物体，frame只读取，不复制
+        return frame, self.detect_objects(frame, input_frame)
+    
+    def show_result(self, frame, detections):
+        """在结果图像上标记检测结果，作为最新结果显示"""
+        self.overlay_index ^= 1
+        self.last_frame = self.draw_detections(frame, detections, self.overlays[self.overlay_index])
+        return self.last_frame
+    
+    def manual_detection(self):
+        """手动触发检测（不依赖语音）"""
+        with self.detect_lock:
+            # 捕获一帧图像
+            ret, frame = self.camera.read()
+            if not ret:
+                print("无法获取图像")
+                return
+            
+            frame, detections = self.detect_frame(frame)
+            self.last_result = detections
+            
+            if self.annotate:
+                # 保存结果图像
+                cv2.imwrite('/home/pi/TonyPi/detection_result.jpg', self.show_result(frame, detections))
         
-        # 在图像上标记检测结果
-        result_frame = self.draw_detections(frame.copy(), detections)
+        # 输出检测结果
+        self.speak_results(detections)
+    
+    def detection_worker(self):
+        """连续识别模式：按detect_rate不断识别最新的画面，结果加入时间衰减统计"""
+        period = 1.0 / self.detect_rate
+        seq = 0
+        while not self.exit_flag:
+            start = time.monotonic()
+            with self.detect_lock:
+                seq, stamp, frame = self.camera.latest(seq)
+                if frame is None:
+                    continue
+                frame, detections = self.detect_frame(frame)
+                self.aggregate.update(detections, stamp)
+                if self.annotate:
+                    self.show_result(frame, detections)
+            time.sleep(max(0.0, period - (time.monotonic() - start)))
+    
+    def answer(self):
+        """回答"这是什么"：连续识别模式下直接使用最近几帧的统计结果，否则立即识别一次"""
+        if not self.continuous:
+            self.tts.TTSModuleSpeak('', '好的')
+            time.sleep(0.5)  # 给TTS一些播放时间
+            return self.manual_detection()
         
-        # 保存最新结果
-        self.last_frame = result_frame
+        detections = self.aggregate.result(time.monotonic())
+        if detections is None:
+            # 后台识别没有最近的结果
+            return self.manual_detection()
         self.last_result = detections
-        
-        # 保存结果图像
-        cv2.imwrite('/home/pi/TonyPi/detection_result.jpg', result_frame)
-        
-        # 输出检测结果
+        if self.annotate and self.last_frame is not None:
+            # 保存结果图像
+            cv2.imwrite('/home/pi/TonyPi/detection_result.jpg', self.last_frame)
         self.speak_results(detections)
     
     def run(self):
@@ -307,7 +517,14 @@ class ObjectDetection:
         # 启动显示线程
         display_thread = threading.Thread(target=self.display_thread)
         display_thread.daemon = True
-        display_thread.start()
+        if self.annotate:
+            display_thread.start()
+        
+        # 连续识别模式下启动后台识别线程
+        detection_thread = threading.Thread(target=self.detection_worker)
+        detection_thread.daemon = True
+        if self.continuous:
+            detection_thread.start()
         
         try:
             print("开始运行物体检测程序")
@@ -323,9 +540,7 @@ class ObjectDetection:
                         print(f'识别编号: {data}')
                         if data == 2:  # "这是什么"
                             print("收到语音命令：这是什么")
-                            self.tts.TTSModuleSpeak('', '好的')
-                            time.sleep(0.5)  # 给TTS一些播放时间
-                            self.manual_detection()
+                            self.answer()
                 except Exception as e:
                     print(f"获取语音命令失败: {e}")
                     print(f"详细错误: {traceback.format_exc()}")
@@ -337,7 +552,10 @@ class ObjectDetection:
                     key = sys.stdin.readline().strip()
                     if key == '':  # Enter键
                         print("手动触发检测...")
-                        self.manual_detection()
+                        if self.continuous:
+                            self.answer()
+                        else:
+                            self.manual_detection()
                     elif key.lower() == 'q':
                         break
                 
@@ -347,7 +565,10 @@ class ObjectDetection:
             print("程序被用户中断")
         finally:
             self.exit_flag = True
-            display_thread.join(timeout=1.0)
+            if self.annotate:
+                display_thread.join(timeout=1.0)
+            if self.continuous:
+                detection_thread.join(timeout=2.0)
             cv2.destroyAllWindows()
             self.camera.camera_close()
             print("物体检测程序已结束")
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# coding=utf8
+# 目标半径滤波：保存最近几次的半径，去掉与均值相差超过一个标准差的值后取平均。
+# 数据放在固定大小的NumPy环形缓冲区中，每次更新的时间和内存都是常数，不需要pandas
+import numpy as np
+
+FILTER_SIZE = 5  # 参与计算的最近数据个数
+
+class RadiusFilter:
+    """
+    去除离群值的滑动平均
+
+    与原来每帧用pandas.DataFrame计算的结果相同：均值和样本标准差(ddof=1)按最近size个数据计算，
+    只对与均值相差不超过一个标准差的数据取平均。只有一个数据时返回该数据
+
+    Args:
+        size: 参与计算的最近数据个数
+    """
+    def __init__(self, size=FILTER_SIZE):
+        self.data = np.zeros(size, dtype=np.float64)
+        self.count = 0  # 缓冲区中的数据个数
+        self.index = 0  # 下一个数据写入的位置
+
+    def reset(self):
+        self.count = 0
+        self.index = 0
+
+    def update(self, value):
+        """加入一个数据，返回滤波后的值"""
+        size = len(self.data)
+        self.data[self.index] = value
+        self.index = (self.index + 1) % size
+        if self.count < size:
+            self.count += 1
+        if self.count == 1:
+            return float(value)
+        # 缓冲区未满时只使用前count个数据，顺序不影响结果
+        values = self.data[:self.count]
+        u = values.mean()
+        std = values.std(ddof=1)
+        return float(values[np.abs(values - u) <= std].mean())
+
+if __name__ == '__main__':
+    # 与原来的pandas实现比较结果和耗时
+    import time
+    import pandas as pd
+
+    def pandas_filter(radius_data, radius):
+        radius_data.append(radius)
+        data = pd.DataFrame(radius_data)
+        data_ = data.copy()
+        u = data_.mean()  # 计算均值
+        std = data_.std()  # 计算标准差
+
+        data_c = data[np.abs(data - u) <= std]
+        circle_radius = round(data_c.mean()[0], 1)
+        if len(radius_data) == 5:
+            radius_data.remove(radius_data[0])
+        return circle_radius
+
+    samples = np.random.RandomState(0).randint(60, 220, 2000).tolist()
+    radius_data = []
+    radius_filter = RadiusFilter()
+    t = time.perf_counter()
+    expected = [pandas_filter(radius_data, r) for r in samples]
+    pandas_time = (time.perf_counter() - t) / len(samples)
+    t = time.perf_counter()
+    result = [round(radius_filter.update(r), 1) for r in samples]
+    ring_time = (time.perf_counter() - t) / len(samples)
+
+    # pandas对只有一个数据的标准差返回NaN，第一个结果不比较
+    same = sum(a == b for a, b in zip(expected[1:], result[1:]))
+    print('结果相同: %d/%d' % (same, len(samples) - 1))
+    print('pandas: %.1fus  RadiusFilter: %.1fus  (每次更新)' % (pandas_time * 1e6, ring_time * 1e6))
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# coding=utf8
+# 目标位置预测：对目标在画面中的位置和半径做匀速模型的卡尔曼滤波，
+# 根据画面的采集时间把目标位置外推到舵机动作的时刻，补偿取帧和处理的延时
+import threading
+import numpy as np
+
+PROCESS_NOISE = 20000.0   # 加速度噪声的谱密度(像素^2/秒^3)，越大越相信新的测量值
+MEASUREMENT_NOISE = 9.0   # 测量噪声的方差(像素^2)
+MAX_GAP = 0.5             # 超过该时间(秒)没有测量值时认为目标丢失，下次测量重新开始
+MAX_PREDICT = 0.3         # 最多向后预测的时间(秒)，防止外推过远
+
+class TargetPredictor:
+    """
+    匀速模型的卡尔曼滤波器
+
+    x、y和半径三个量相互独立，各自的状态为(位置, 速度)，按测量值的时间间隔预测，
+    可以在任意线程中调用
+
+    Args:
+        process_noise: 加速度噪声的谱密度
+        measurement_noise: 测量噪声的方差
+        max_gap: 超过该时间(秒)没有测量值时认为目标丢失
+        max_predict: 最多向后预测的时间(秒)
+    """
+    def __init__(self, process_noise=PROCESS_NOISE, measurement_noise=MEASUREMENT_NOISE,
+                 max_gap=MAX_GAP, max_predict=MAX_PREDICT):
+        self.q = process_noise
+        self.r = measurement_noise
+        self.max_gap = max_gap
+        self.max_predict = max_predict
+        self.lock = threading.Lock()
+        self.pos = np.zeros(3)  # x, y, 半径
+        self.vel = np.zeros(3)
+        # 协方差矩阵[[p00, p01], [p01, p11]]，三个量各一个
+        self.p00 = np.zeros(3)
+        self.p01 = np.zeros(3)
+        self.p11 = np.zeros(3)
+        self.stamp = None       # 最后一个测量值的时间
+
+    def reset(self):
+        with self.lock:
+            self.stamp = None
+
+    def update(self, measurement, stamp):
+        """
+        加入一个测量值
+
+        Args:
+            measurement: (x, y, 半径)
+            stamp: 测量值对应画面的采集时间(time.monotonic())
+        """
+        z = np.asarray(measurement, dtype=np.float64)
+        with self.lock:
+            if self.stamp is None or not 0 <= stamp - self.stamp <= self.max_gap:
+                # 第一个测量值，速度未知
+                self.pos[:] = z
+                self.vel[:] = 0
+                self.p00[:] = self.r
+                self.p01[:] = 0
+                self.p11[:] = 1e6
+                self.stamp = stamp
+                return
+            # 预测到测量时刻
+            dt = stamp - self.stamp
+            self.pos += self.vel * dt
+            q = self.q
+            self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt ** 3 / 3
+            self.p01 += dt * self.p11 + q * dt ** 2 / 2
+            self.p11 += q * dt
+            # 用测量值校正
+            s = self.p00 + self.r
+            k0 = self.p00 / s
+            k1 = self.p01 / s
+            e = z - self.pos
+            self.pos += k0 * e
+            self.vel += k1 * e
+            self.p11 -= k1 * self.p01
+            self.p01 -= k0 * self.p01
+            self.p00 -= k0 * self.p00
+            self.stamp = stamp
+
+    def predict(self, stamp):
+        """
+        预测stamp时刻的目标位置
+
+        Returns:
+            (x, y, 半径)，没有测量值或目标已丢失时返回None
+        """
+        with self.lock:
+            if self.stamp is None or stamp - self.stamp > self.max_gap:
+                return None
+            dt = min(max(stamp - self.stamp, 0.0), self.max_predict)
+            x, y, radius = (self.pos + self.vel * dt).tolist()
+        return x, y, max(radius, 0.0)
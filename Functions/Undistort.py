@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+# coding=utf8
+# 畸变矫正：直接按处理分辨率生成定点数映射表，畸变矫正和缩小用一次remap完成，
+# 不再先对640x480的整帧做浮点remap再缩小。映射表保存为.npy文件，启动时直接内存映射读取：
+# 文件放在标定参数所在文件夹的undistort_cache中，文件名包含标定参数的哈希值，重新标定后自动重新生成
+import os
+import cv2
+import hashlib
+import numpy as np
+
+CAMERA_SIZE = (640, 480)  # 相机标定时的图像大小
+MAP_CACHE_VERSION = 1     # 映射表的生成方法改变时加1，使旧的缓存失效
+
+def load_calibration(param_path):
+    """读取标定参数，param_path为不含.npz后缀的路径"""
+    param_data = np.load(param_path + '.npz')
+    return param_data['mtx_array'], param_data['dist_array']
+
+def scale_camera_matrix(mtx, src_size, dst_size):
+    """把相机内参从src_size缩放到dst_size，按像素中心对齐"""
+    sx = dst_size[0] / float(src_size[0])
+    sy = dst_size[1] / float(src_size[1])
+    m = np.array(mtx, dtype=np.float64)
+    m[0, 0] *= sx
+    m[0, 1] *= sx
+    m[0, 2] = (m[0, 2] + 0.5) * sx - 0.5
+    m[1, 1] *= sy
+    m[1, 2] = (m[1, 2] + 0.5) * sy - 0.5
+    return m
+
+def build_maps(mtx, dist, size, src_size=CAMERA_SIZE, m1type=cv2.CV_16SC2):
+    """
+    生成从src_size的原图直接得到size大小矫正图像的映射表
+
+    新的相机内参与原来一样按src_size计算(getOptimalNewCameraMatrix, alpha=0)，再缩放到size，
+    因此结果与先按src_size矫正再缩小到size相同
+
+    Returns:
+        (map1, map2)，默认为CV_16SC2定点数格式
+    """
+    newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, src_size, 0, src_size)
+    return cv2.initUndistortRectifyMap(mtx, dist, None, scale_camera_matrix(newcameramtx, src_size, size),
+                                       size, m1type)
+
+def calibration_hash(param_path):
+    """标定参数文件内容的哈希值"""
+    with open(param_path + '.npz', 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+def save_npy(file_path, array):
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, file_path)
+
+def load_maps(param_path, size, src_size=CAMERA_SIZE, m1type=cv2.CV_16SC2, cache_dir=None):
+    """
+    读取映射表，缓存不存在或标定参数、分辨率改变时重新生成并保存
+
+    缓存文件名包含标定参数文件的哈希值、输入输出大小和映射表格式，
+    读取时使用内存映射，不需要解析和复制数据
+
+    Args:
+        param_path: 标定参数路径，不含.npz后缀
+        size: 输出图像大小(宽, 高)
+        src_size: 输入图像大小(宽, 高)
+        m1type: 映射表格式，cv2.CV_16SC2或cv2.CV_32FC1
+        cache_dir: 缓存文件夹，默认为标定参数所在文件夹下的undistort_cache
+
+    Returns:
+        (map1, map2)
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(param_path), 'undistort_cache')
+    key = 'v%d_%s_%dx%d_%dx%d_%d' % (MAP_CACHE_VERSION, calibration_hash(param_path),
+                                     src_size[0], src_size[1], size[0], size[1], m1type)
+    paths = [os.path.join(cache_dir, '%s_map%d.npy' % (key, i)) for i in (1, 2)]
+    try:
+        return tuple(np.load(path, mmap_mode='r') for path in paths)
+    except (OSError, ValueError):
+        pass
+
+    mtx, dist = load_calibration(param_path)
+    maps = build_maps(mtx, dist, size, src_size, m1type)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # 删除同一输入输出大小和格式的旧缓存
+        suffix = key[key.index('_', len('v%d_' % MAP_CACHE_VERSION)):]
+        for name in os.listdir(cache_dir):
+            if name.endswith('.npy') and suffix in name and not name.startswith(key):
+                os.remove(os.path.join(cache_dir, name))
+        for path, m in zip(paths, maps):
+            save_npy(path, m)
+    except OSError as e:
+        print('映射表缓存保存失败: %s' % e)
+    return maps
+
+class Undistorter:
+    """
+    畸变矫正并缩放到处理分辨率
+
+    Args:
+        param_path: 标定参数路径，不含.npz后缀
+        size: 输出图像大小(宽, 高)
+        src_size: 输入图像大小(宽, 高)
+    """
+    def __init__(self, param_path, size, src_size=CAMERA_SIZE):
+        self.size = size
+        self.src_size = src_size
+        self.map1, self.map2 = load_maps(param_path, size, src_size)
+
+    def remap(self, img, dst=None, window=None):
+        """
+        Args:
+            img: src_size大小的原图
+            dst: 输出图像，为None时新建
+            window: 只计算输出图像中的该区域(x0, y0, x1, y1)，为None时计算整幅图像
+
+        Returns:
+            size大小的矫正图像，指定window时为该区域大小的图像
+        """
+        if window is None:
+            return cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR, dst=dst)
+        x0, y0, x1, y1 = window
+        return cv2.remap(img, self.map1[y0:y1, x0:x1], self.map2[y0:y1, x0:x1], cv2.INTER_LINEAR, dst=dst)
@@ -4,16 +4,23 @@ import sys
 import time
 import os
 import re
+import threading
 import traceback
 
 # 添加TonyPi路径以导入相关模块
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'TonyPi'))
+sys.path.append('/home/pi/TonyPi/')
 
 # 导入执行动作所需的模块
 import hiwonder.TTS as TTS
 import hiwonder.Board as Board
-import hiwonder.ActionGroupControl as AGC
-from ActionGroupDict import action_group_dict
+import ActionPlayer
+from ActionBlend import blend_sequence
+from ActionGroupCache import action_cache
+from ActionRegistry import action_registry, expand_action
+
+# 是否将动作序列拼接成连续的帧序列执行，动作之间不再停顿和回到立正姿态
+blend_actions = False
 
 class VoiceHelper:
     """语音播报助手，参考vlm_ud.py中的实现"""
@@ -59,6 +66,10 @@ class VoiceHelper:
                 segments.append(segment)
         return segments
     
+    def speech_time(self, text):
+        """估计一段文本的播放时间(秒)"""
+        return min(max(len(text) * 0.15, 0.8), 3)
+
     def _speak_segment(self, text):
         """实际执行TTS播放的内部函数"""
         if not text or len(text.strip()) == 0:
@@ -73,8 +84,7 @@ class VoiceHelper:
             # 添加音量和发音方式控制
             self.tts.TTSModuleSpeak('[h0][v10]', text)
             # 给TTS足够的播放时间
-            sleep_time = min(max(len(text) * 0.15, 0.8), 3)
-            time.sleep(sleep_time)
+            time.sleep(self.speech_time(text))
         except Exception as e:
             print(f"TTS播放失败: {e}")
             print(traceback.format_exc())
@@ -112,43 +122,118 @@ class VoiceHelper:
 
         print(f"播放结束。")
 
-def execute_action_sequence(action_sequence, voice_helper):
+    def speak_async(self, text):
+        """在后台线程中播报，返回线程对象，可与动作同时进行"""
+        th = threading.Thread(target=self.safe_speak, args=(text,))
+        th.daemon = True
+        th.start()
+        return th
+
+    def speak_at(self, text, when):
+        """在when时刻(与time.monotonic()可直接比较)开始在后台播报，返回定时器线程"""
+        th = threading.Timer(max(when - time.monotonic(), 0.0), self.safe_speak, args=(text,))
+        th.daemon = True
+        th.start()
+        return th
+
+def execute_blended_sequence(action_sequence, voice_helper):
+    """
+    将动作序列拼接成一个连续的帧序列执行，动作之间不停顿，
+    并在过渡安全时跳过动作之间多余的立正姿态
+    
+    Args:
+        action_sequence: 包含动作序列的列表，每个动作是一个包含sequence_id和action_id的字典
+        voice_helper: 语音助手实例
+    """
+    action_names = ['stand']
+    for action in sorted(action_sequence, key=lambda x: x['sequence_id']):
+        action_name = action_registry.name_of(action['action_id'])
+        if action_name is None:
+            print(f"警告: 未找到ID为 {action['action_id']} 的动作")
+            continue
+        action_names.append(action_name)
+    action_names.append('stand')
+
+    groups = []
+    for action_name in action_names:
+        for name in expand_action(action_name):
+            data = action_cache.get(name)
+            if data is None:
+                print(f"警告: 未找到动作组文件 {name}")
+                continue
+            groups.append((data.frames, data.times))
+
+    stand = action_cache.get('stand')
+    stand_pose = stand.frames[-1] if stand is not None else None
+    frames, times = blend_sequence(groups, stand_pose)
+    print(f"连续执行动作: {' -> '.join(action_names)} (共{len(times)}帧, {times.sum() / 1000.0:.1f}秒)")
+
+    speech = voice_helper.speak_async(f"开始执行{len(action_names) - 2}个动作")
+    ActionPlayer.runFrames(frames, times)
+    speech.join()
+    voice_helper.safe_speak("动作序列执行完毕")
+
+def execute_action_sequence(action_sequence, voice_helper, blend=None):
     """
     按顺序执行动作序列
     
     Args:
         action_sequence: 包含动作序列的列表，每个动作是一个包含sequence_id和action_id的字典
         voice_helper: 语音助手实例
+        blend: 是否连续执行，为None时使用blend_actions的设置
     """
-    # 确保机器人处于站立状态
+    if blend is None:
+        blend = blend_actions
+    if blend:
+        execute_blended_sequence(action_sequence, voice_helper)
+        return
+
+    # 确保机器人处于站立状态，runActionGroup执行完才返回，不需要再等待
     print("初始化机器人姿态...")
-    AGC.runActionGroup('stand')
-    time.sleep(1)
-    
-    # 按顺序执行每个动作
+    ActionPlayer.runActionGroup('stand')
+
+    steps = []
     for action in sorted(action_sequence, key=lambda x: x['sequence_id']):
-        action_id = action['action_id']
-        sequence_id = action['sequence_id']
-        
-        try:
-            # 获取动作名称
-            action_name = action_group_dict[action_id]
-            print(f"执行动作 {sequence_id}: {action_name} (ID: {action_id})")
-            
-            # 语音提示当前执行的动作
-            voice_helper.safe_speak(f"第{sequence_id}个动作")
-            
-            # 执行动作
-            AGC.runActionGroup(action_name, 1, True)
-            time.sleep(0.5)  # 动作间短暂停顿
-            
-        except KeyError:
-            print(f"警告: 未找到ID为 {action_id} 的动作")
-            voice_helper.safe_speak(f"未知动作")
-    
-    # 执行完毕，回到站立姿态
-    AGC.runActionGroup('stand')
-    voice_helper.safe_speak("动作序列执行完毕")
+        action_name = action_registry.name_of(action['action_id'])
+        if action_name is None:
+            print(f"警告: 未找到ID为 {action['action_id']} 的动作")
+            voice_helper.safe_speak("未知动作")
+            continue
+        steps.append((action['sequence_id'], action['action_id'], action_name))
+
+    start_time = time.monotonic()
+    completion = action_registry.predict_completion([name for _, _, name in steps] + ['stand'], start_time)
+    print(f"预计用时 {completion - start_time:.1f} 秒")
+
+    # 动作之间不停顿，上一个动作结束后立即执行下一个。
+    # 下一个动作的播报按当前动作的预计时长安排，在当前动作结束时正好播完；
+    # 播报之间不重叠，当前动作太短时下一个播报顺延
+    speeches = []
+    speech_end = start_time
+
+    def schedule(text, when):
+        nonlocal speech_end
+        when = max(when, speech_end)
+        speeches.append(voice_helper.speak_at(text, when))
+        speech_end = when + voice_helper.speech_time(text)
+
+    if steps:
+        schedule(f"第{steps[0][0]}个动作", start_time)
+    for k, (sequence_id, action_id, action_name) in enumerate(steps):
+        action_start = time.monotonic()
+        duration = action_registry.duration(action_name)
+        print(f"执行动作 {sequence_id}: {action_name} (ID: {action_id}, 预计{duration:.1f}秒)")
+        if k + 1 < len(steps):
+            text = f"第{steps[k + 1][0]}个动作"
+            schedule(text, action_start + duration - voice_helper.speech_time(text))
+        ActionPlayer.runActionGroup(action_name, 1, True)
+
+    # 执行完毕，回到站立姿态，同时播报
+    schedule("动作序列执行完毕", time.monotonic())
+    ActionPlayer.runActionGroup('stand')
+    for speech in speeches:
+        speech.join()
+    print(f"实际用时 {time.monotonic() - start_time:.1f} 秒")
 
 def main(command_str):
     """
@@ -159,6 +244,9 @@ def main(command_str):
     """
     # 初始化语音助手
     voice_helper = VoiceHelper()
+
+    # 预先编译动作组
+    ActionPlayer.preload()
     
     try:
         # 播报开始处理指令